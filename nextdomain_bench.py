@@ -0,0 +1,308 @@
+"""Offline benchmark harness for nextdomaindev.
+
+Starts a local synthetic website, runs the scanner operations against it and
+saves throughput, latency percentiles, peak memory and UI render time to a
+JSON file, so runs from different versions can be compared as numbers.
+
+    python nextdomain_bench.py --pages 500 --fanout 5 --page-size 4096 --latency-ms 5 --error-rate 0.01
+"""
+import argparse
+import hashlib
+import http.server
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import nextdomaindev as nd
+
+
+class SyntheticSite:
+    """Generated website served from a local HTTP server.
+
+    Page N links to pages N*fanout+1 .. N*fanout+fanout, every page is padded to
+    page_size bytes, each response waits latency seconds and a deterministic
+    error_rate share of pages answer 500.
+    """
+
+    def __init__(self, pages=200, fanout=5, page_size=4096, latency=0.0, error_rate=0.0, seed=1211):
+        self.pages = pages
+        self.fanout = fanout
+        self.page_size = page_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = seed
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = None
+
+    def is_error(self, number):
+        return random.Random(self.seed * 100003 + number).random() < self.error_rate
+
+    def page_body(self, number):
+        first = number * self.fanout + 1
+        links = "".join(f'<li><a href="/page/{child}">Page {child}</a></li>'
+                        for child in range(first, min(first + self.fanout, self.pages)))
+        head = f"<!doctype html><html><head><title>Page {number}</title></head><body><h1>Page {number}</h1><ul>{links}</ul>"
+        tail = "</body></html>"
+        filler_size = max(self.page_size - len(head) - len(tail) - 7, 0)
+        filler = ("lorem ipsum dolor sit amet " * (filler_size // 27 + 1))[:filler_size]
+        return (head + "<p>" + filler + "</p>" + tail).encode("utf-8")
+
+    def start(self):
+        site = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def respond(self, send_body=True):
+                with site.lock:
+                    site.requests += 1
+                if site.latency:
+                    time.sleep(site.latency)
+                path = self.path.split("?", 1)[0]
+                number = 0 if path == "/" else int(path.rsplit("/", 1)[-1]) if path.startswith("/page/") and \
+                    path.rsplit("/", 1)[-1].isdigit() else -1
+                if number < 0 or number >= site.pages:
+                    status, body = 404, b"not found"
+                elif site.is_error(number):
+                    status, body = 500, b"synthetic error"
+                else:
+                    status, body = 200, site.page_body(number)
+                etag = '"' + hashlib.md5(body).hexdigest() + '"'
+                if status == 200 and self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(body)
+
+            def do_GET(self):
+                self.respond()
+
+            def do_HEAD(self):
+                self.respond(send_body=False)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                self.respond()
+
+            do_PUT = do_POST
+            do_DELETE = do_GET
+            do_OPTIONS = do_GET
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_port}/"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def summarize(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": nd.percentile(ordered, 0.50) * 1000,
+        "p95_ms": nd.percentile(ordered, 0.95) * 1000,
+        "p99_ms": nd.percentile(ordered, 0.99) * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def measure(name, func, items, site):
+    """Run func over items, returning timing, throughput and peak traced memory"""
+    nd.response_cache.clear()
+    requests_before = site.requests
+    latencies = []
+    tracemalloc.start()
+    started = time.perf_counter()
+    for item in items:
+        call_started = time.perf_counter()
+        func(item)
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    result = {
+        "operation": name,
+        "calls": len(latencies),
+        "elapsed_s": elapsed,
+        "calls_per_s": len(latencies) / elapsed if elapsed else None,
+        "server_requests": site.requests - requests_before,
+        "peak_memory_kb": peak // 1024,
+        "latency": summarize(latencies),
+    }
+    print(f"  {name:<16} {elapsed:8.3f}s  {result['calls_per_s'] or 0:9.1f} calls/s  "
+          f"p95 {result['latency'].get('p95_ms', 0):8.1f} ms  peak {result['peak_memory_kb']:,} KB")
+    return result
+
+
+def measure_scan(base_url, site, name="scan_website"):
+    """Crawl the whole site; run it again as "rescan" to measure the conditional-request path"""
+    nd.response_cache.clear()
+    requests_before = site.requests
+    bytes_before = nd.metrics.snapshot()["bytes"]
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = nd.scan_domain(base_url, max_depth=site.pages)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    found = len(result["pages"]) + len(result["hidden_pages"])
+    fetched = site.requests - requests_before
+    received = nd.metrics.snapshot()["bytes"] - bytes_before
+    print(f"  {name:<16} {elapsed:8.3f}s  {fetched / elapsed:9.1f} pages/s  "
+          f"found {found} pages  {received // 1024:,} KB received  peak {peak // 1024:,} KB")
+    return {
+        "operation": name,
+        "elapsed_s": elapsed,
+        "pages_found": found,
+        "server_requests": fetched,
+        "pages_per_s": fetched / elapsed if elapsed else None,
+        "bytes_received": received,
+        "peak_memory_kb": peak // 1024,
+        "error": result["error"],
+        "unchanged_pages": result["diff"]["unchanged"] if result["diff"] else None,
+    }
+
+
+def measure_render(page_urls):
+    """Time how long the Tk main loop takes to drain code dumps and a typewriter banner"""
+    if nd.tk is None:
+        return {"operation": "render", "skipped": "tkinter not available"}
+    try:
+        root = nd.tk.Tk()
+    except nd.tk.TclError as e:
+        return {"operation": "render", "skipped": f"no display ({e})"}
+    root.withdraw()
+    widget = nd.tk.Text(root)
+    nd.root = root
+    results = []
+    try:
+        dump = "\n".join(nd.get_frontend_code(url) for url in page_urls)
+        for name, post in (("render_code_dump", lambda: nd.render_text(dump, widget)),
+                           ("typewriter_banner", lambda: nd.typewriter("N" * nd.typewriter_max_chars, widget))):
+            widget.delete(1.0, nd.tk.END)
+            post()
+            frames = 0
+            started = time.perf_counter()
+            while not nd.ui_queue.empty() or nd.ui_backlog:
+                # One frame per pass; drain_ui_queue would start another self-rescheduling loop each call
+                nd.drain_ui_frame()
+                root.update()
+                frames += 1
+                time.sleep(1.0 / nd.render_max_fps)
+            elapsed = time.perf_counter() - started
+            print(f"  {name:<16} {elapsed:8.3f}s  {frames} frames for {len(widget.get(1.0, nd.tk.END)):,} chars")
+            results.append({"operation": name, "elapsed_s": elapsed, "frames": frames})
+    finally:
+        root.destroy()
+        nd.root = None
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def compare_with_previous(results, out_dir, current_path):
+    previous = sorted(name for name in os.listdir(out_dir)
+                      if name.endswith(".json") and os.path.join(out_dir, name) != current_path)
+    if not previous:
+        return
+    with open(os.path.join(out_dir, previous[-1]), "r", encoding="utf-8") as f:
+        before = {item["operation"]: item for item in json.load(f)["operations"]}
+    print(f"\nChange vs {previous[-1]} (elapsed):")
+    for item in results["operations"]:
+        old = before.get(item["operation"])
+        if old and old.get("elapsed_s") and item.get("elapsed_s"):
+            change = (item["elapsed_s"] - old["elapsed_s"]) / old["elapsed_s"] * 100
+            print(f"  {item['operation']:<16} {old['elapsed_s']:8.3f}s -> {item['elapsed_s']:8.3f}s  ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark nextdomain against a local synthetic website")
+    parser.add_argument("--pages", type=int, default=300, help="pages in the synthetic site")
+    parser.add_argument("--fanout", type=int, default=5, help="links per page")
+    parser.add_argument("--page-size", type=int, default=8192, help="bytes per page")
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="server delay per response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of pages answering 500")
+    parser.add_argument("--sample", type=int, default=50, help="pages used for the per-page operations")
+    parser.add_argument("--out", default="bench_results", help="folder for result files")
+    parser.add_argument("--label", default="", help="free text stored with the results")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.out, exist_ok=True)
+    nd.crash_log_path = os.path.join(tempfile.gettempdir(), "nextdomain_bench_crash_log.txt")
+    nd.history_db_path = os.path.join(tempfile.gettempdir(), f"nextdomain_bench_{os.getpid()}.db")
+    site = SyntheticSite(args.pages, args.fanout, args.page_size, args.latency_ms / 1000.0, args.error_rate)
+    base_url = site.start()
+    page_urls = [base_url] + [f"{base_url}page/{number}" for number in range(1, min(args.sample, args.pages))]
+    print(f"Synthetic site at {base_url}: {args.pages} pages, fan-out {args.fanout}, "
+          f"{args.page_size} B/page, {args.latency_ms} ms latency, {args.error_rate:.0%} errors")
+    try:
+        operations = [
+            measure_scan(base_url, site),
+            measure_scan(base_url, site, "rescan"),
+            measure("codewebfront", nd.get_frontend_code, page_urls, site),
+            measure("fetchtext", nd.fetch_text, page_urls, site),
+            measure("send_requests", nd.send_requests, page_urls[:max(len(page_urls) // 5, 1)], site),
+        ]
+        render = measure_render(page_urls[:10])
+        if isinstance(render, dict):
+            print(f"  {'render':<16} skipped: {render['skipped']}")
+            render = [render]
+        operations += render
+    finally:
+        site.stop()
+
+    results = {
+        "time": time.strftime('%Y-%m-%d %H:%M:%S'),
+        "revision": git_revision(),
+        "label": args.label,
+        "python": sys.version.split()[0],
+        "site": {"pages": args.pages, "fanout": args.fanout, "page_size": args.page_size,
+                 "latency_ms": args.latency_ms, "error_rate": args.error_rate},
+        "operations": operations,
+        "metrics": nd.metrics.snapshot(),
+    }
+    path = os.path.join(args.out, f"bench_{time.strftime('%Y%m%d_%H%M%S')}_{results['revision'] or 'local'}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {path}")
+    compare_with_previous(results, args.out, path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
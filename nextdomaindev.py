@@ -1,60 +1,548 @@
 import requests
-import tkinter as tk
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+from urllib3.util.connection import allowed_gai_family
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NameResolutionError, ConnectTimeoutError
 from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urljoin, urlparse, urlunparse
+from email.utils import parsedate_to_datetime
+from html.parser import HTMLParser
 import subprocess
 import threading
+import queue
 import time
-from tkinter import simpledialog, ttk
-import urllib.request
 import sys
 import traceback
 import os
 import platform
+import argparse
+import codecs
+import sqlite3
+import atexit
+import cProfile
+import pstats
+import http.client
+import hashlib
+import json
+import csv
+import zlib
+import socket
+import multiprocessing
+import math
+from array import array
+from urllib.robotparser import RobotFileParser
+from xml.etree import ElementTree
+from collections import deque, OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.util import Finalize
+try:
+    import tkinter as tk
+    from tkinter import simpledialog, ttk
+except ImportError:
+    # Headless installs can still use the scanner API and the command line
+    tk = None
 
 
 # Global crash handler
-crash_log = []
+crash_log_path = "crash_log.txt"
+crash_log_max_bytes = 1024 * 1024
+crash_log_backups = 3
+crash_log_buffer_size = 500
+crash_log_flush_interval = 1.0
 
+# Most recent crashes for the crashlog command; older ones only live on disk
+crash_log = deque(maxlen=crash_log_buffer_size)
+crash_count = 0
+crash_lock = threading.Lock()
+crash_queue = queue.Queue()
+crash_writer = None
+# Serializes file writes against clear_crash_log; queued entries carry the generation, bumped by every clear
+crash_write_lock = threading.Lock()
+crash_generation = 0
 
-def log_crash(error_info):
-    """Log crashes for debugging"""
-    crash_log.append({
+# Command being run on this thread, filled in by process_command
+command_context = threading.local()
+
+
+def log_crash(error_info, url=None, elapsed=None):
+    """Log crashes for debugging.
+
+    The entry goes into the in-memory ring buffer right away and is written to
+    crash_log.txt in batches by a background thread. Command, URL, exception
+    type and elapsed time are filled in from the current command and the
+    exception being handled when not given.
+    """
+    global crash_count
+    exc_type = sys.exc_info()[0]
+    started = getattr(command_context, "started", None)
+    if elapsed is None and started is not None:
+        elapsed = time.monotonic() - started
+    entry = {
         'time': time.strftime('%Y-%m-%d %H:%M:%S'),
-        'error': error_info
-    })
+        'error': error_info,
+        'command': getattr(command_context, "command", None),
+        'url': url or getattr(command_context, "url", None),
+        'type': exc_type.__name__ if exc_type else None,
+        'elapsed': round(elapsed, 3) if elapsed is not None else None,
+    }
+    with crash_lock:
+        crash_log.append(entry)
+        crash_count += 1
+    crash_queue.put((crash_generation, entry))
+    start_crash_writer()
+
+
+def format_crash(entry):
+    fields = [f"{name}={entry[name]}" for name in ("command", "url", "type") if entry.get(name)]
+    if entry.get("elapsed") is not None:
+        fields.append(f"elapsed={entry['elapsed']}s")
+    suffix = f" | {' '.join(fields)}" if fields else ""
+    return f"[{entry['time']}] {entry['error']}{suffix}"
+
+
+def start_crash_writer():
+    global crash_writer
+    with crash_lock:
+        if crash_writer is None or not crash_writer.is_alive():
+            crash_writer = threading.Thread(target=crash_writer_loop, daemon=True)
+            crash_writer.start()
+
+
+def crash_writer_loop():
+    """Write queued entries in batches until flush_crash_log queues None"""
+    stopping = False
+    while not stopping:
+        first = crash_queue.get()
+        batch = [] if first is None else [first]
+        stopping = first is None
+        deadline = time.monotonic() + crash_log_flush_interval
+        while not stopping:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = crash_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                stopping = True
+            else:
+                batch.append(entry)
+        write_crash_batch(batch)
+
+
+def write_crash_batch(batch):
+    """Append (generation, entry) pairs to the log file, dropping those queued before a clear"""
+    with crash_write_lock:
+        batch = [entry for generation, entry in batch if generation == crash_generation]
+        if not batch:
+            return
+        try:
+            rotate_crash_log()
+            with open(crash_log_path, 'a', encoding='utf-8') as f:
+                f.write("".join(f"\n{format_crash(entry)}\n" for entry in batch))
+        except:
+            pass
+
+
+def rotate_crash_log():
+    """Shift crash_log.txt to crash_log.txt.1 (and older ones up) once it grows past the size limit"""
+    if not os.path.exists(crash_log_path) or os.path.getsize(crash_log_path) < crash_log_max_bytes:
+        return
+    for index in range(crash_log_backups - 1, 0, -1):
+        older = f"{crash_log_path}.{index}"
+        if os.path.exists(older):
+            os.replace(older, f"{crash_log_path}.{index + 1}")
+    if crash_log_backups > 0:
+        os.replace(crash_log_path, f"{crash_log_path}.1")
+    else:
+        os.remove(crash_log_path)
+
+
+def drain_crash_queue():
+    batch = []
+    while True:
+        try:
+            entry = crash_queue.get_nowait()
+        except queue.Empty:
+            return batch
+        if entry is not None:
+            batch.append(entry)
+
+
+def flush_crash_log():
+    """Stop the writer after its current batch and write out anything still queued (called at exit)"""
+    writer = crash_writer
+    if writer is not None and writer.is_alive():
+        crash_queue.put(None)
+        writer.join(crash_log_flush_interval + 5)
+    write_crash_batch(drain_crash_queue())
+
+
+atexit.register(flush_crash_log)
+
+
+def clear_crash_log():
+    global crash_count, crash_generation
+    with crash_lock:
+        crash_log.clear()
+        crash_count = 0
+    with crash_write_lock:
+        # Entries still queued or gathered by the writer belong to the log being cleared
+        crash_generation += 1
+        drain_crash_queue()
+        for index in range(crash_log_backups, -1, -1):
+            path = f"{crash_log_path}.{index}" if index else crash_log_path
+            if os.path.exists(path):
+                os.remove(path)
+
+
+# Command timing and opt-in profiling
+command_timings = deque(maxlen=200)
+timing_lock = threading.Lock()
+profile_dir = "profiles"
+profile_remaining = 0
+profile_active = False  # Python allows one active profiler at a time (3.12+ raises on a second)
+
+
+def current_timing():
+    return getattr(command_context, "timing", None)
+
+
+def add_timing(kind, seconds, timing=None):
+    """Add seconds of network, parse or render work to the running command's timing"""
+    timing = timing if timing is not None else current_timing()
+    if timing is not None:
+        with timing_lock:
+            timing[kind] += seconds
+
+
+class JobCancelled(BaseException):
+    """Raised inside a cancelled background job; a BaseException so the commands' error handlers let it through"""
+
+
+class CancelToken(threading.Event):
+    """Cancellation flag that also runs registered callbacks when set, so blocked reads can be interrupted"""
+
+    def __init__(self):
+        super().__init__()
+        self.callbacks = set()
+        self.callback_lock = threading.Lock()
+
+    def add_callback(self, func):
+        with self.callback_lock:
+            if not self.is_set():
+                self.callbacks.add(func)
+                return
+        func()
+
+    def remove_callback(self, func):
+        with self.callback_lock:
+            self.callbacks.discard(func)
+
+    def set(self):
+        with self.callback_lock:
+            super().set()
+            callbacks = list(self.callbacks)
+            self.callbacks.clear()
+        for func in callbacks:
+            try:
+                func()
+            except Exception:
+                pass
+
+
+def check_cancelled():
+    """Raise JobCancelled when the background job running on this thread has been cancelled"""
+    cancel = getattr(command_context, "cancel", None)
+    if cancel is not None and cancel.is_set():
+        raise JobCancelled()
+
+
+def bind_command_context(func):
+    """Wrap func so a worker thread reports into the calling thread's command context"""
+    command = getattr(command_context, "command", None)
+    url = getattr(command_context, "url", None)
+    started = getattr(command_context, "started", None)
+    timing = current_timing()
+    cancel = getattr(command_context, "cancel", None)
+
+    def run_in_context(*args, **kwargs):
+        command_context.command = command
+        command_context.url = url
+        command_context.started = started
+        command_context.timing = timing
+        command_context.cancel = cancel
+        return func(*args, **kwargs)
+    return run_in_context
+
+
+def run_command(name, url, func, *args):
+    """Run one command with wall/network/parse/render timing, under cProfile while profiling is on.
+
+    cProfile only sees the command's own thread, so time spent in crawl and
+    probe worker pools shows up as waits. A command started while another is
+    being profiled runs unprofiled and leaves the count for the next one.
+    """
+    global profile_remaining, profile_active
+    timing = {"time": time.strftime('%Y-%m-%d %H:%M:%S'), "command": name, "url": url,
+              "wall": 0.0, "network": 0.0, "parse": 0.0, "render": 0.0}
+    command_context.command = name
+    command_context.url = url
+    command_context.started = time.monotonic()
+    command_context.timing = timing
+    with timing_lock:
+        profiler = cProfile.Profile() if profile_remaining > 0 and not profile_active else None
+        if profiler is not None:
+            profile_remaining -= 1
+            profile_active = True
     try:
-        with open('crash_log.txt', 'a') as f:
-            f.write(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}] {error_info}\n")
-    except:
-        pass
+        if profiler is not None:
+            return profiler.runcall(func, *args)
+        return func(*args)
+    finally:
+        timing["wall"] = time.monotonic() - command_context.started
+        command_timings.append(timing)
+        command_context.timing = None
+        if profiler is not None:
+            with timing_lock:
+                profile_active = False
+            save_profile(profiler, name)
+
+
+def save_profile(profiler, name):
+    try:
+        os.makedirs(profile_dir, exist_ok=True)
+        safe_name = "".join(c if c.isalnum() else "_" for c in name)[:40] or "command"
+        base = os.path.join(profile_dir, f"{time.strftime('%Y%m%d_%H%M%S')}_{safe_name}")
+        profiler.dump_stats(base + ".prof")
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(40)
+        typewriter(f"Profile saved to {base}.prof", output)
+    except Exception as e:
+        log_crash(f"Profile save error: {str(e)}")
+
+
+def format_timings(count=20):
+    rows = list(command_timings)[-count:]
+    if not rows:
+        return "No commands timed yet."
+    lines = [f"{'time':<19}  {'command':<18} {'wall':>8} {'network':>8} {'parse':>8} {'render':>8}  (seconds)"]
+    for timing in reversed(rows):
+        lines.append(f"{timing['time']:<19}  {timing['command'][:18]:<18} {timing['wall']:8.3f} "
+                     f"{timing['network']:8.3f} {timing['parse']:8.3f} {timing['render']:8.3f}")
+    lines.append("\nNetwork and parse time add up across worker threads, so they can exceed wall time.")
+    return "\n".join(lines)
+
+
+# Scan history store (replaces the plain ~/activity.log list of domains)
+history_db_path = os.path.expanduser("~/nextdomain_history.db")
+legacy_activity_log = os.path.expanduser("~/activity.log")
+history_page_size = 20
+
+history_conn = None
+history_lock = threading.Lock()
+
 
+def open_history():
+    """Return the shared SQLite connection, creating the schema on first use"""
+    global history_conn
+    if history_conn is None:
+        conn = sqlite3.connect(history_db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS scans (
+                id INTEGER PRIMARY KEY,
+                scanned_at REAL NOT NULL,
+                domain TEXT NOT NULL,
+                url TEXT NOT NULL,
+                status_code INTEGER,
+                page_count INTEGER NOT NULL DEFAULT 0,
+                hidden_count INTEGER NOT NULL DEFAULT 0,
+                pages_fetched INTEGER NOT NULL DEFAULT 0,
+                elapsed REAL,
+                error TEXT,
+                status_counts TEXT,
+                pages TEXT,
+                hidden_pages TEXT
+            );
+            CREATE INDEX IF NOT EXISTS scans_by_time ON scans (scanned_at);
+            CREATE INDEX IF NOT EXISTS scans_by_domain ON scans (domain, scanned_at);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS crawl_pages (
+                start_url TEXT NOT NULL,
+                url TEXT NOT NULL,
+                status_code INTEGER,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT,
+                links TEXT,
+                PRIMARY KEY (start_url, url)
+            );
+        """)
+        import_legacy_activity_log(conn)
+        history_conn = conn
+    return history_conn
 
-# Activity log function
-def log_domain(domain):
-    """Log each domain entered by the user"""
-    log_path = os.path.expanduser("~/activity.log")
+
+def import_legacy_activity_log(conn):
+    """Copy domains from the old ~/activity.log into the history once"""
+    if conn.execute("SELECT 1 FROM meta WHERE key = 'activity_log_imported'").fetchone():
+        return
     try:
-        with open(log_path, "a", encoding="utf-8") as log_file:
-            log_file.write(domain + "\n")
+        if os.path.exists(legacy_activity_log):
+            imported_at = os.path.getmtime(legacy_activity_log)
+            with open(legacy_activity_log, "r", encoding="utf-8") as log_file:
+                rows = [(imported_at, urlparse(line.strip()).netloc or line.strip(), line.strip())
+                        for line in log_file if line.strip()]
+            conn.executemany("INSERT INTO scans (scanned_at, domain, url) VALUES (?, ?, ?)", rows)
+        conn.execute("INSERT INTO meta (key, value) VALUES ('activity_log_imported', ?)", (str(time.time()),))
+        conn.commit()
     except Exception as e:
-        log_crash(f"Activity log write error: {str(e)}")
+        log_crash(f"Activity log import error: {str(e)}")
 
 
-def show_activity_log():
-    """Display all previously logged domains"""
-    log_path = os.path.expanduser("~/activity.log")
+def record_scan(result):
+    """Store one scan_domain result in the history"""
     try:
-        with open(log_path, "r", encoding="utf-8") as log_file:
-            domains = log_file.readlines()
-            if domains:
-                log_text = "\n".join([d.strip() for d in domains])
-                typewriter("=== Activity Log ===", output)
-                typewriter(log_text, output)
-            else:
-                typewriter("No domains have been logged yet.", output)
-    except FileNotFoundError:
-        typewriter("No domains have been logged yet.", output)
+        with history_lock:
+            conn = open_history()
+            conn.execute(
+                "INSERT INTO scans (scanned_at, domain, url, status_code, page_count, hidden_count, pages_fetched,"
+                " elapsed, error, status_counts, pages, hidden_pages) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), urlparse(result["url"]).netloc, result["url"], result.get("status_code"),
+                 len(result["pages"]), len(result["hidden_pages"]), result.get("pages_fetched", 0),
+                 result.get("elapsed"), result.get("error"), json.dumps(result.get("status_counts", {})),
+                 json.dumps(result["pages"]), json.dumps(result["hidden_pages"])))
+            conn.commit()
+    except Exception as e:
+        log_crash(f"History write error: {str(e)}")
+
+
+def query_history(domain=None, since=None, until=None, limit=None, offset=0):
+    """Return summary rows (newest first) matching the filters, plus the total match count"""
+    limit = history_page_size if limit is None else limit
+    where, params = [], []
+    if domain:
+        where.append("domain = ?")
+        params.append(domain)
+    if since is not None:
+        where.append("scanned_at >= ?")
+        params.append(since)
+    if until is not None:
+        where.append("scanned_at < ?")
+        params.append(until)
+    clause = (" WHERE " + " AND ".join(where)) if where else ""
+    with history_lock:
+        conn = open_history()
+        total = conn.execute("SELECT COUNT(*) FROM scans" + clause, params).fetchone()[0]
+        rows = conn.execute(
+            "SELECT id, scanned_at, domain, url, status_code, page_count, hidden_count, elapsed, error"
+            " FROM scans" + clause + " ORDER BY scanned_at DESC, id DESC LIMIT ? OFFSET ?",
+            params + [limit, offset]).fetchall()
+    return rows, total
+
+
+def get_history_scan(scan_id):
+    with history_lock:
+        row = open_history().execute(
+            "SELECT url, scanned_at, status_code, elapsed, error, status_counts, pages, hidden_pages"
+            " FROM scans WHERE id = ?", (scan_id,)).fetchone()
+    return row
+
+
+def clear_history():
+    with history_lock:
+        conn = open_history()
+        conn.execute("DELETE FROM scans")
+        conn.execute("DELETE FROM crawl_pages")
+        conn.commit()
+
+
+def load_crawl_state(start_url):
+    """Crawl records of the previous scan of start_url, keyed by URL; pages that were only discovered have no status"""
+    with history_lock:
+        rows = open_history().execute(
+            "SELECT url, status_code, etag, last_modified, content_hash, links FROM crawl_pages WHERE start_url = ?",
+            (start_url,)).fetchall()
+    return {url: {"status_code": status_code, "etag": etag, "last_modified": last_modified,
+                  "hash": content_hash, "links": json.loads(links) if links else []}
+            for url, status_code, etag, last_modified, content_hash, links in rows}
+
+
+def save_crawl_state(start_url, records, discovered):
+    """Replace the stored crawl state of start_url with this scan's records and discovered URLs"""
+    rows = [(start_url, url, record["status_code"], record["etag"], record["last_modified"], record["hash"],
+             json.dumps(record["links"])) for url, record in records.items()]
+    rows += [(start_url, url, None, None, None, None, None) for url in discovered if url not in records]
+    with history_lock:
+        conn = open_history()
+        conn.execute("DELETE FROM crawl_pages WHERE start_url = ?", (start_url,))
+        conn.executemany("INSERT INTO crawl_pages VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.commit()
+
+
+def parse_history_date(value):
+    return time.mktime(time.strptime(value, "%Y-%m-%d"))
+
+
+def format_history_row(row):
+    scan_id, scanned_at, domain, url, status_code, page_count, hidden_count, elapsed, error = row
+    stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(scanned_at))
+    if error:
+        detail = error
+    elif status_code is None and elapsed is None:
+        detail = "imported from activity.log"
+    else:
+        detail = f"{page_count} pages, {hidden_count} hidden, status {status_code}, {elapsed:.2f}s"
+    return f"#{scan_id} [{stamp}] {url} - {detail}"
+
+
+def show_activity_log(args=""):
+    """Display scan history.
+
+    args: "last N", "page N", "domain NAME", "since YYYY-MM-DD", "until YYYY-MM-DD"
+    (combinable), or "scan ID" for the pages of one scan.
+    """
+    try:
+        tokens = args.split()
+        options = dict(zip(tokens[::2], tokens[1::2]))
+        if "scan" in options:
+            row = get_history_scan(int(options["scan"]))
+            if row is None:
+                typewriter("No scan with that id.", output)
+                return
+            url, scanned_at, status_code, elapsed, error, status_counts, pages, hidden_pages = row
+            lines = [f"=== Scan of {url} at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(scanned_at))} ==="]
+            lines.append(error or f"Status {status_code}, {elapsed or 0:.2f}s, status counts {status_counts}")
+            lines += ["Pages Found:"] + [f" - {p}" for p in json.loads(pages or "[]")]
+            lines += ["\nHidden Pages:"] + [f" - {h}" for h in json.loads(hidden_pages or "[]")]
+            render_text("\n".join(lines), output)
+            return
+        limit = int(options.get("last", history_page_size))
+        if limit < 1:
+            # SQLite reads a negative LIMIT as no limit at all
+            typewriter("Error: last N needs N of 1 or more.", output)
+            return
+        page = max(int(options.get("page", 1)), 1)
+        since = parse_history_date(options["since"]) if "since" in options else None
+        until = parse_history_date(options["until"]) + 86400 if "until" in options else None
+        rows, total = query_history(options.get("domain"), since, until, limit, (page - 1) * limit)
+        if not rows:
+            typewriter("No domains have been logged yet." if not total else "No more entries.", output)
+            return
+        typewriter("=== Activity Log ===", output)
+        last_page = (total + limit - 1) // limit
+        lines = [format_history_row(row) for row in rows]
+        lines.append(f"\nPage {page} of {last_page} ({total} scans). "
+                     "Use: activitylog [last N] [page N] [domain NAME] [since|until YYYY-MM-DD] | activitylog scan ID")
+        render_text("\n".join(lines), output)
+    except ValueError:
+        typewriter("Error: Invalid activitylog arguments. Dates use YYYY-MM-DD, counts and ids are numbers.", output)
     except Exception as e:
         log_crash(f"Activity log read error: {str(e)}")
         typewriter("Error reading activity log.", output)
@@ -141,72 +629,2079 @@ def safe_execute(func, fallback_message="Operation failed. Continuing safely..."
         return fallback_message
 
 
-def typewriter(text, text_widget, delay=0.01):
+# Output rendering settings
+typewriter_effect = True
+typewriter_max_chars = 200
+render_chunk_size = 256 * 1024
+render_max_fps = 30
+
+# UI event queue: worker threads post here, the Tk main loop drains it
+ui_queue = queue.Queue()
+ui_backlog = deque()
+
+
+def ui_post(func, *args, **kwargs):
+    """Queue a widget call to run on the Tk main loop, in posting order"""
+    ui_queue.put(("call", func, args, kwargs, current_timing()))
+
+
+def ui_call_sync(func, *args, **kwargs):
+    """Run func on the Tk main loop and wait for its result (dialogs and prompts)"""
+    if threading.current_thread() is threading.main_thread():
+        return func(*args, **kwargs)
+    done = threading.Event()
+    result = {}
+
+    def runner():
+        try:
+            result["value"] = func(*args, **kwargs)
+        except Exception as e:
+            result["error"] = e
+        finally:
+            done.set()
+    ui_queue.put(("call", runner, (), {}, None))
+    done.wait()
+    if "error" in result:
+        raise result["error"]
+    return result.get("value")
+
+
+def start_worker(func, *args):
+    threading.Thread(target=func, args=args, daemon=True).start()
+
+
+def render_text(text, text_widget):
+    """Queue text for insertion; the main loop inserts it in large chunks"""
+    ui_queue.put(("text", text_widget, text + "\n", current_timing()))
+
+
+def typewriter(text, text_widget, delay=0.01, end="\n"):
+    """Type short banners character by character, render anything longer instantly"""
+    if not typewriter_effect or len(text) > typewriter_max_chars:
+        ui_queue.put(("text", text_widget, text + end, current_timing()))
+        return
+    ui_queue.put(["type", text_widget, text + end, delay, 0, None, current_timing()])
+
+
+def drain_ui_frame():
+    """Apply one frame of queued UI work on the main loop.
+
+    Adjacent text for the same widget is coalesced into one insert, at most
+    render_chunk_size characters are inserted per frame, and a running
+    typewriter banner holds back later items until it has finished.
+    """
+    while True:
+        try:
+            ui_backlog.append(ui_queue.get_nowait())
+        except queue.Empty:
+            break
+    budget = render_chunk_size
+    while ui_backlog and budget > 0:
+        item = ui_backlog[0]
+        item_started = time.perf_counter()
+        try:
+            if item[0] == "call":
+                ui_backlog.popleft()
+                func, args, kwargs = item[1:4]
+                func(*args, **kwargs)
+            elif item[0] == "text":
+                ui_backlog.popleft()
+                text_widget, parts = item[1], [item[2]]
+                while ui_backlog and ui_backlog[0][0] == "text" and ui_backlog[0][1] is text_widget:
+                    parts.append(ui_backlog.popleft()[2])
+                text = "".join(parts)
+                if len(text) > budget:
+                    ui_backlog.appendleft(("text", text_widget, text[budget:], item[3]))
+                    text = text[:budget]
+                budget -= len(text)
+                text_widget.insert(tk.END, text)
+            else:
+                text_widget, text, delay, position, started = item[1:6]
+                now = time.monotonic()
+                if started is None:
+                    item[5] = started = now
+                target = min(len(text), int((now - started) / delay) + 1)
+                text_widget.insert(tk.END, text[position:target])
+                item[4] = target
+                if target < len(text):
+                    add_timing("render", time.perf_counter() - item_started, item[-1])
+                    break
+                ui_backlog.popleft()
+        except Exception as e:
+            if ui_backlog and ui_backlog[0] is item:
+                ui_backlog.popleft()
+            log_crash(f"UI update error: {str(e)}")
+        add_timing("render", time.perf_counter() - item_started, item[-1])
+
+
+def drain_ui_queue():
+    """Apply a frame of queued UI work, then reschedule itself at render_max_fps"""
     try:
-        for char in text:
-            text_widget.insert(tk.END, char)
-            text_widget.update()
-            time.sleep(delay)
-        text_widget.insert(tk.END, "\n")
+        drain_ui_frame()
+    finally:
+        root.after(max(1, 1000 // render_max_fps), drain_ui_queue)
+
+
+# Live metrics settings
+metrics_latency_samples = 500
+metrics_latency_hosts = 256  # most recently used hosts kept; older ones are dropped
+metrics_latency_shown = 15
+metrics_rate_window = 10.0
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Metrics:
+    """Counters updated by the network layer and shown by the log console"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.in_flight = 0
+        self.requests = 0
+        self.bytes = 0
+        self.errors = {}
+        self.completed_at = deque()
+        self.latencies = OrderedDict()
+        self.gauges = {}
+
+    def request_started(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def request_finished(self, host, seconds, error=None):
+        now = time.monotonic()
+        with self.lock:
+            self.in_flight -= 1
+            self.requests += 1
+            self.completed_at.append(now)
+            while self.completed_at and now - self.completed_at[0] > metrics_rate_window:
+                self.completed_at.popleft()
+            samples = self.latencies.get(host)
+            if samples is None:
+                samples = self.latencies[host] = deque(maxlen=metrics_latency_samples)
+                while len(self.latencies) > metrics_latency_hosts:
+                    self.latencies.popitem(last=False)
+            else:
+                self.latencies.move_to_end(host)
+            samples.append(seconds)
+            if error:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def add_bytes(self, count):
+        with self.lock:
+            self.bytes += count
+
+    def record_error(self, name):
+        with self.lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def adjust_gauge(self, name, delta):
+        with self.lock:
+            self.gauges[name] = self.gauges.get(name, 0) + delta
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self.lock:
+            window = min(metrics_rate_window, max(time.time() - self.started_at, 1e-6))
+            recent = sum(1 for stamp in self.completed_at if now - stamp <= metrics_rate_window)
+            hosts = {}
+            # Percentiles only for the busiest hosts, the ones render shows
+            busiest = sorted(self.latencies.items(), key=lambda item: -len(item[1]))[:metrics_latency_shown]
+            for host, samples in busiest:
+                ordered = sorted(samples)
+                hosts[host] = {"count": len(ordered), "p50": percentile(ordered, 0.50),
+                               "p95": percentile(ordered, 0.95), "p99": percentile(ordered, 0.99)}
+            snapshot = {
+                "time": time.strftime('%Y-%m-%d %H:%M:%S'),
+                "in_flight": self.in_flight,
+                "requests": self.requests,
+                "requests_per_second": recent / window,
+                "bytes": self.bytes,
+                "errors": dict(self.errors),
+                "gauges": dict(self.gauges),
+                "latency": hosts,
+            }
+        snapshot["cache"] = response_cache.stats()
+        snapshot["dns"] = dns_cache.stats()
+        snapshot["gauges"]["ui_queue"] = ui_queue.qsize()
+        snapshot["gauges"]["crash_queue"] = crash_queue.qsize()
+        return snapshot
+
+    def render(self):
+        snap = self.snapshot()
+        lines = [
+            f"=== NEXTDOMAIN live metrics ({snap['time']}) ===",
+            f"Requests in flight: {snap['in_flight']}",
+            f"Requests/sec:       {snap['requests_per_second']:.1f} (total {snap['requests']})",
+            f"Bytes transferred:  {snap['bytes']:,}",
+            f"Cache hit rate:     {snap['cache']['hit_rate'] * 100:.0f}% "
+            f"({snap['cache']['hits']} hits / {snap['cache']['misses']} misses)",
+            f"DNS hit rate:       {snap['dns']['hit_rate'] * 100:.0f}% "
+            f"({snap['dns']['hits']} hits / {snap['dns']['misses']} lookups, "
+            f"{snap['dns']['prefetched_connections']} connections prefetched)",
+            "Queues:             " + ", ".join(f"{name} {value}" for name, value in sorted(snap["gauges"].items())),
+            "",
+            "Latency per host (ms)      p50      p95      p99      n",
+        ]
+        for host, stats in sorted(snap["latency"].items(), key=lambda item: -item[1]["count"]):
+            lines.append(f"  {host[:24]:<24} {stats['p50'] * 1000:8.1f} {stats['p95'] * 1000:8.1f} "
+                         f"{stats['p99'] * 1000:8.1f} {stats['count']:6d}")
+        lines.append("")
+        lines.append("Errors by type:" + ("" if snap["errors"] else " none"))
+        for name, count in sorted(snap["errors"].items(), key=lambda item: -item[1]):
+            lines.append(f"  {name}: {count}")
+        return "\n".join(lines)
+
+
+metrics = Metrics()
+
+
+def export_metrics(path=None):
+    """Write a JSON snapshot of the live metrics and return its path"""
+    path = path or f"metrics_snapshot_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(metrics.snapshot(), f, indent=2)
+    return path
+
+
+# HTTP transport settings
+http_pool_size = 32
+http_timeout = 5
+http_retries = 2
+http_backoff = 0.3
+http_headers = {"User-Agent": "Nextdomain/3.1211"}
+
+http_session = None
+http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """Return the shared keep-alive session, creating it on first use"""
+    global http_session
+    with http_session_lock:
+        if http_session is None:
+            # Read timeouts are not retried so they still surface as requests Timeout errors
+            retry = Retry(total=http_retries, connect=http_retries, read=False, status=http_retries,
+                          backoff_factor=http_backoff, status_forcelist=(502, 503, 504), raise_on_status=False)
+            adapter = CachedDNSAdapter(pool_connections=http_pool_size, pool_maxsize=http_pool_size, max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update(http_headers)
+            http_session = session
+        return http_session
+
+
+def reset_http_session():
+    """Close pooled connections so the next request picks up new transport settings"""
+    global http_session
+    with http_session_lock:
+        if http_session is not None:
+            try:
+                http_session.close()
+            except Exception as e:
+                log_crash(f"HTTP session close error: {str(e)}")
+            http_session = None
+
+
+def wire_bytes(response):
+    """Body bytes read off the connection so far, before decompression; None when the transport does not say"""
+    try:
+        return response.raw.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def http_request(method, url, **kwargs):
+    """Send a request through the shared session with the default timeout"""
+    kwargs.setdefault("timeout", http_timeout)
+    host = urlparse(url).netloc
+    metrics.request_started()
+    started = time.monotonic()
+    try:
+        response = get_http_session().request(method, url, **kwargs)
     except Exception as e:
-        log_crash(f"Typewriter error: {str(e)}")
+        metrics.request_finished(host, time.monotonic() - started, type(e).__name__)
+        raise
+    error = f"HTTP {response.status_code // 100}xx" if response.status_code >= 400 else None
+    metrics.request_finished(host, time.monotonic() - started, error)
+    add_timing("network", time.monotonic() - started)
+    if not kwargs.get("stream"):
+        read = wire_bytes(response)
+        metrics.add_bytes(len(response.content) if read is None else read)
+    return response
+
+
+# DNS cache and connection prefetch
+dns_cache_ttl = 300  # getaddrinfo exposes no record TTL, so answers are kept this long
+dns_negative_ttl = 30
+dns_cache_max_entries = 4096
+prefetch_connections = True
+
+
+class DNSCache:
+    """Caching getaddrinfo for the HTTP session's connections; concurrent lookups of one name share a single query"""
+
+    def __init__(self, resolve, ttl, negative_ttl, max_entries):
+        self.resolve = resolve
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.failures = 0
+        self.lookup_seconds = 0.0
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        key = (host, port, family, type, proto, flags)
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    expires, result = entry
+                    if expires > time.monotonic():
+                        self.entries.move_to_end(key)
+                        self.hits += 1
+                        if isinstance(result, Exception):
+                            raise result
+                        return result
+                    del self.entries[key]
+                    self.expired += 1
+                waiting = self.pending.get(key)
+                if waiting is None:
+                    self.pending[key] = threading.Event()
+                    self.misses += 1
+                    break
+            waiting.wait()
+        started = time.monotonic()
+        result = ttl = None
         try:
-            text_widget.insert(tk.END, text + "\n")
-        except:
+            result = self.resolve(host, port, family, type, proto, flags)
+            ttl = self.ttl
+        except socket.gaierror as e:
+            result = e
+            ttl = self.negative_ttl
+        finally:
+            # Anything other than a resolver answer propagates uncached; waiters then retry themselves
+            with self.lock:
+                self.lookup_seconds += time.monotonic() - started
+                if ttl is not None:
+                    if isinstance(result, Exception):
+                        self.failures += 1
+                    self.entries[key] = (time.monotonic() + ttl, result)
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+                self.pending.pop(key).set()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        prefetch = prefetcher.stats()
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                    "expired": self.expired, "failures": self.failures,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "lookup_ms": self.lookup_seconds * 1000,
+                    "prefetched_connections": prefetch["warmed"], "prefetch_errors": prefetch["errors"]}
+
+    def summary(self):
+        stats = self.stats()
+        return (f"DNS: {stats['hits']} hits, {stats['misses']} lookups ({stats['hit_rate'] * 100:.0f}% hit rate, "
+                f"{stats['lookup_ms']:.0f} ms resolving), {stats['failures']} failed, {stats['entries']} cached; "
+                f"{stats['prefetched_connections']} connections prefetched")
+
+
+dns_cache = DNSCache(socket.getaddrinfo, dns_cache_ttl, dns_negative_ttl, dns_cache_max_entries)
+
+
+class CachedDNSConnectionMixin:
+    """Resolves the connection's host through dns_cache and connects to each address in turn"""
+
+    def _new_conn(self):
+        try:
+            addresses = dns_cache.getaddrinfo(self._dns_host, self.port, allowed_gai_family(), socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            raise NameResolutionError(self.host, self, e) from e
+        # SNI and the Host header use self.host, so only the address urllib3 dials changes
+        host = self._dns_host
+        error = None
+        try:
+            for address in addresses:
+                self._dns_host = address[4][0]
+                try:
+                    return super()._new_conn()
+                except ConnectTimeoutError as e:
+                    error = e
+        finally:
+            self._dns_host = host
+        raise error
+
+
+class CachedDNSHTTPConnection(CachedDNSConnectionMixin, HTTPConnection):
+    pass
+
+
+class CachedDNSHTTPSConnection(CachedDNSConnectionMixin, HTTPSConnection):
+    pass
+
+
+class WarmPoolMixin:
+    def warm(self, connections, timeout):
+        """Make sure the pool has made connections connections; returns how many were opened"""
+        opened = 0
+        # Connections already made count, busy ones included, so a warm-up that arrives once the
+        # crawl is running adds nothing; checked out together so idle ones are not opened twice
+        checked_out = []
+        try:
+            for _ in range(connections - self.num_connections):
+                checked_out.append(self._get_conn())
+            for conn in checked_out:
+                if getattr(conn, "sock", None) is None:
+                    conn.timeout = timeout
+                    conn.connect()
+                    opened += 1
+        finally:
+            for conn in checked_out:
+                self._put_conn(conn)
+        return opened
+
+
+class CachedDNSHTTPConnectionPool(WarmPoolMixin, HTTPConnectionPool):
+    ConnectionCls = CachedDNSHTTPConnection
+
+
+class CachedDNSHTTPSConnectionPool(WarmPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = CachedDNSHTTPSConnection
+
+
+class CachedDNSAdapter(HTTPAdapter):
+    """HTTPAdapter whose direct connections resolve through dns_cache and can be opened ahead of use"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": CachedDNSHTTPConnectionPool,
+                                                   "https": CachedDNSHTTPSConnectionPool}
+
+
+class ConnectionPrefetcher:
+    """Resolves hosts and opens idle pooled connections ahead of the fetch workers"""
+
+    def __init__(self):
+        self.requests = queue.Queue()
+        self.worker = None
+        self.lock = threading.Lock()
+        self.warmed = 0
+        self.errors = 0
+
+    def warm(self, url, connections=1):
+        """Ask for url's origin to have at least connections idle connections in the session pool"""
+        if not prefetch_connections:
+            return
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self.run, daemon=True)
+                self.worker.start()
+        self.requests.put((url, connections))
+
+    def run(self):
+        while True:
+            url, connections = self.requests.get()
+            try:
+                opened = self.open_connections(url, connections)
+            except Exception:
+                # Not worth a crash log entry: the real fetch will report the same problem
+                with self.lock:
+                    self.errors += 1
+            else:
+                with self.lock:
+                    self.warmed += opened
+
+    def stats(self):
+        with self.lock:
+            return {"warmed": self.warmed, "errors": self.errors}
+
+    def open_connections(self, url, connections):
+        session = get_http_session()
+        # A real request merges the environment (CA bundle, proxies) into its settings, and those pick the pool
+        settings = session.merge_environment_settings(url, {}, None, None, None)
+        if requests.utils.select_proxy(url, settings["proxies"]):
+            return 0
+        adapter = session.get_adapter(url)
+        if hasattr(adapter, "get_connection_with_tls_context"):
+            pool = adapter.get_connection_with_tls_context(requests.Request("GET", url).prepare(), settings["verify"],
+                                                           cert=settings["cert"])
+        else:
+            pool = adapter.get_connection(url)
+        if not isinstance(pool, WarmPoolMixin):
+            return 0
+        # Same bound as a real request's connect, so an unreachable host cannot stall the worker
+        return pool.warm(connections, http_timeout)
+
+
+prefetcher = ConnectionPrefetcher()
+
+
+# Response cache settings
+cache_max_bytes = 64 * 1024 * 1024
+cache_fresh_seconds = 30  # heuristic lifetime of responses with validators but no max-age or Expires
+cache_dir = None  # set to a folder path to keep cached responses on disk too
+cache_disk_max_bytes = 256 * 1024 * 1024
+
+
+class CachedResponse:
+    """Body, headers and validators of a GET response kept in the response cache"""
+
+    def __init__(self, url, status_code, headers, content, encoding=None, stored_at=None, redirects=None,
+                 vary=None):
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+        self.encoding = encoding
+        self.stored_at = stored_at if stored_at is not None else time.time()
+        self.redirects = redirects or []
+        # Values of the request headers named by Vary when this response was stored
+        self.vary = vary or {}
+        self.from_cache = False
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+    @property
+    def etag(self):
+        return self.headers.get("ETag")
+
+    @property
+    def last_modified(self):
+        return self.headers.get("Last-Modified")
+
+    def cache_directives(self):
+        return {directive.strip() for directive in self.headers.get("Cache-Control", "").lower().split(",")}
+
+    def max_age(self):
+        """Freshness lifetime in seconds from max-age or Expires; heuristic only when there are validators"""
+        for directive in self.cache_directives():
+            if directive.startswith("max-age="):
+                try:
+                    return max(int(directive[8:]), 0)
+                except ValueError:
+                    return 0
+        expires = self.headers.get("Expires")
+        if expires:
+            try:
+                date = self.headers.get("Date")
+                origin = parsedate_to_datetime(date).timestamp() if date else self.stored_at
+                return max(parsedate_to_datetime(expires).timestamp() - origin, 0)
+            except (TypeError, ValueError, IndexError):
+                return 0
+        return cache_fresh_seconds if self.etag or self.last_modified else 0
+
+    def is_fresh(self):
+        if "no-cache" in self.cache_directives():
+            return False
+        return time.time() - self.stored_at < self.max_age()
+
+    def is_storable(self):
+        """Worth caching: not no-store or Vary: *, and either fresh for a while or revalidatable"""
+        if "no-store" in self.cache_directives() or self.headers.get("Vary", "").strip() == "*":
+            return False
+        return bool(self.etag or self.last_modified or self.max_age())
+
+    def matches(self, request_headers):
+        """True when the request sends the same values for the Vary headers as the stored one"""
+        return all(request_headers.get(name) == value for name, value in self.vary.items())
+
+    def size(self):
+        return len(self.content)
+
+    @classmethod
+    def from_response(cls, response):
+        return cls(response.url, response.status_code, dict(response.headers), response.content,
+                   response.encoding or response.apparent_encoding)
+
+
+def vary_values(response_headers, request_headers):
+    """Request header values named by the response's Vary header, for matching later requests"""
+    names = [name.strip() for name in response_headers.get("Vary", "").split(",") if name.strip()]
+    return {name.lower(): request_headers.get(name) for name in names}
+
+
+def effective_request_headers(headers):
+    """Headers a GET through the shared session actually sends, with per-request headers on top"""
+    merged = CaseInsensitiveDict(get_http_session().headers)
+    merged.update(headers)
+    return merged
+
+
+class ResponseCache:
+    """Size-bounded LRU cache of GET responses, in memory and optionally on disk"""
+
+    def __init__(self, max_bytes, directory=None, disk_max_bytes=0):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.disk_entries = OrderedDict()
+        self.disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.lock = threading.Lock()
+        if directory:
+            self._load_disk_index()
+
+    def _disk_key(self, url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _load_disk_index(self):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            bodies = []
+            for name in os.listdir(self.directory):
+                if name.endswith(".body"):
+                    stat = os.stat(os.path.join(self.directory, name))
+                    bodies.append((stat.st_mtime, name[:-5], stat.st_size))
+            for _, key, size in sorted(bodies):
+                self.disk_entries[key] = size
+                self.disk_bytes += size
+        except Exception as e:
+            log_crash(f"Cache index error: {str(e)}")
+            self.directory = None
+
+    def _read_disk(self, url):
+        key = self._disk_key(url)
+        if key not in self.disk_entries:
+            return None
+        path = os.path.join(self.directory, key)
+        try:
+            with open(path + ".json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(path + ".body", "rb") as f:
+                content = f.read()
+            os.utime(path + ".body")
+            self.disk_entries.move_to_end(key)
+            return CachedResponse(meta["url"], meta["status_code"], meta["headers"], content,
+                                  meta.get("encoding"), meta.get("stored_at"), meta.get("redirects"), meta.get("vary"))
+        except Exception as e:
+            log_crash(f"Cache read error for {url}: {str(e)}")
+            return None
+
+    def _write_disk_meta(self, path, entry):
+        # Written aside and renamed, since scan processes may share the directory
+        temp_path = f"{path}.json.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"url": entry.url, "status_code": entry.status_code, "headers": dict(entry.headers),
+                       "encoding": entry.encoding, "stored_at": entry.stored_at,
+                       "redirects": entry.redirects, "vary": entry.vary}, f)
+        os.replace(temp_path, path + ".json")
+
+    def _remove_disk(self, key):
+        for suffix in (".body", ".json"):
+            try:
+                os.remove(os.path.join(self.directory, key + suffix))
+            except FileNotFoundError:
+                pass
+
+    def _write_disk(self, url, entry):
+        key = self._disk_key(url)
+        path = os.path.join(self.directory, key)
+        try:
+            temp_path = f"{path}.body.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(entry.content)
+            os.replace(temp_path, path + ".body")
+            self._write_disk_meta(path, entry)
+            self.disk_bytes += entry.size() - self.disk_entries.pop(key, 0)
+            self.disk_entries[key] = entry.size()
+            while self.disk_bytes > self.disk_max_bytes and len(self.disk_entries) > 1:
+                old_key, old_size = self.disk_entries.popitem(last=False)
+                self.disk_bytes -= old_size
+                self._remove_disk(old_key)
+        except Exception as e:
+            log_crash(f"Cache write error for {url}: {str(e)}")
+
+    def get(self, url):
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is not None:
+                self.entries.move_to_end(url)
+                return entry
+            if self.directory:
+                entry = self._read_disk(url)
+                if entry is not None:
+                    self._store_memory(url, entry)
+            return entry
+
+    def _store_memory(self, url, entry):
+        old = self.entries.pop(url, None)
+        if old is not None:
+            self.total_bytes -= old.size()
+        if entry.size() > self.max_bytes:
+            return
+        self.entries[url] = entry
+        self.total_bytes += entry.size()
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= evicted.size()
+
+    def put(self, url, entry):
+        with self.lock:
+            self._store_memory(url, entry)
+            if self.directory:
+                self._write_disk(url, entry)
+
+    def refresh(self, url, entry, headers):
+        """Apply a 304's headers to entry and restart its freshness, on disk too"""
+        with self.lock:
+            entry.headers.update(headers)
+            entry.stored_at = time.time()
+            key = self._disk_key(url)
+            if self.directory and key in self.disk_entries:
+                try:
+                    self._write_disk_meta(os.path.join(self.directory, key), entry)
+                except Exception as e:
+                    log_crash(f"Cache write error for {url}: {str(e)}")
+
+    def record(self, hit, revalidated=False):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            if revalidated:
+                self.revalidated += 1
+
+    def discard(self, url):
+        with self.lock:
+            entry = self.entries.pop(url, None)
+            if entry is not None:
+                self.total_bytes -= entry.size()
+            if self.directory:
+                key = self._disk_key(url)
+                if key in self.disk_entries:
+                    self.disk_bytes -= self.disk_entries.pop(key)
+                    self._remove_disk(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+            if self.directory:
+                for key in self.disk_entries:
+                    self._remove_disk(key)
+                self.disk_entries.clear()
+                self.disk_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidated": self.revalidated,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "disk_entries": len(self.disk_entries),
+                "disk_bytes": self.disk_bytes,
+            }
+
+    def summary(self):
+        stats = self.stats()
+        return (f"Cache: {stats['hits']} hits, {stats['misses']} misses, {stats['revalidated']} revalidated "
+                f"({stats['hit_rate'] * 100:.0f}% hit rate), {stats['entries']} entries, "
+                f"{stats['bytes'] // 1024} KB in memory")
+
+
+response_cache = ResponseCache(cache_max_bytes, cache_dir, cache_disk_max_bytes)
+
+
+# Streaming body and parser settings
+stream_chunk_size = 64 * 1024
+parse_max_bytes = 5 * 1024 * 1024
+html_parser_backend = "stream"  # "stream" for the incremental parser, "bs4" for BeautifulSoup
+
+
+class BodyStream:
+    """Iterate over a GET body in chunks through the response cache.
+
+    Fresh cache entries are replayed without a request, stale ones are
+    revalidated first. Reading stops after max_bytes; only complete 200
+    bodies are stored back into the cache. With cache off the cache is
+    neither read nor written and chunks are not kept once yielded.
+    """
+
+    def __init__(self, url, max_bytes=None, chunk_size=None, html_only=False, use_range=False, validators=None,
+                 cache=True):
+        self.url = url
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size or stream_chunk_size
+        self.entry = None
+        self.response = None
+        self.skipped = False
+        self.truncated = False
+        self.bytes_read = 0
+        self.not_modified = False
+        self.digest = None
+        self.cancel = None
+        self.stored = None  # the cache entry made from this download, once complete
+        self.cache = cache
+        self._chunks = None
+
+        headers = {}
+        if use_range and max_bytes:
+            # Ask for the first max_bytes only; identity encoding keeps byte offsets meaningful
+            headers["Range"] = f"bytes=0-{max_bytes - 1}"
+            headers["Accept-Encoding"] = "identity"
+        self.request_headers = effective_request_headers(headers)
+        entry = response_cache.get(url) if cache else None
+        if entry is not None and not entry.matches(self.request_headers):
+            entry = None
+        if entry is not None and entry.is_fresh():
+            response_cache.record(hit=True)
+            self._use_entry(entry)
+            return
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        elif validators:
+            # ETag / Last-Modified remembered from an earlier crawl; a 304 means the body is not needed
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+        response = http_request("GET", url, headers=headers, stream=True)
+        if entry is not None and response.status_code == 304:
+            response.close()
+            response_cache.refresh(url, entry, response.headers)
+            response_cache.record(hit=True, revalidated=True)
+            self._use_entry(entry)
+            return
+        if cache:
+            response_cache.record(hit=False)
+        self.response = response
+        self.cancel = getattr(command_context, "cancel", None)
+        if isinstance(self.cancel, CancelToken):
+            self.cancel.add_callback(self.abort)
+        self.final_url = response.url
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.encoding = response.encoding
+        self.redirects = [(hop.status_code, hop.url) for hop in response.history]
+        content_type = response.headers.get("Content-Type", "")
+        if html_only and content_type and "html" not in content_type:
+            self.skipped = True
+            response.close()
+        elif entry is None and validators and response.status_code == 304:
+            self.not_modified = True
+            self.skipped = True
+            response.close()
+
+    def _use_entry(self, entry):
+        entry.from_cache = True
+        self.entry = entry
+        self.final_url = entry.url
+        self.status_code = entry.status_code
+        self.headers = entry.headers
+        self.encoding = entry.encoding
+        self.redirects = entry.redirects
+
+    @property
+    def total_bytes(self):
+        """Full body size when known from the cache, Content-Range or Content-Length"""
+        if self.entry is not None:
+            return len(self.entry.content)
+        if self.status_code == 206:
+            total = self.headers.get("Content-Range", "").rpartition("/")[2]
+            return int(total) if total.isdigit() else None
+        length = self.headers.get("Content-Length", "")
+        if length.isdigit() and "Content-Encoding" not in self.headers:
+            return int(length)
+        return None
+
+    def __iter__(self):
+        if self._chunks is None:
+            self._chunks = self._iter_chunks()
+        return self._chunks
+
+    def _limit(self, chunk):
+        if self.max_bytes is not None and self.bytes_read + len(chunk) >= self.max_bytes:
+            if self.bytes_read + len(chunk) > self.max_bytes:
+                self.truncated = True
+            chunk = chunk[:self.max_bytes - self.bytes_read]
+        self.bytes_read += len(chunk)
+        if self.digest is not None:
+            self.digest.update(chunk)
+        return chunk
+
+    def _iter_chunks(self):
+        if self.entry is not None:
+            content = self.entry.content
+            for start in range(0, len(content), self.chunk_size):
+                chunk = self._limit(content[start:start + self.chunk_size])
+                if chunk:
+                    yield chunk
+                if self.truncated:
+                    return
+            return
+        if self.skipped:
+            return
+        kept = []
+        counted = 0
+        try:
+            chunks = self.response.iter_content(self.chunk_size)
+            while True:
+                waited = time.perf_counter()
+                chunk = next(chunks, None)
+                add_timing("network", time.perf_counter() - waited)
+                if chunk is None:
+                    break
+                # Transferred bytes, which for a compressed body are fewer than the decoded chunk
+                read = wire_bytes(self.response)
+                metrics.add_bytes(len(chunk) if read is None else read - counted)
+                counted = read or 0
+                check_cancelled()
+                chunk = self._limit(chunk)
+                if self.cache:
+                    kept.append(chunk)
+                if chunk:
+                    yield chunk
+                if self.truncated or (self.max_bytes is not None and self.bytes_read >= self.max_bytes):
+                    break
+        finally:
+            self.response.close()
+        # A body that stopped at max_bytes may have had more; only complete bodies are stored
+        complete = not self.truncated and (self.max_bytes is None or self.bytes_read < self.max_bytes)
+        if self.cache and complete and self.status_code == 200:
+            entry = CachedResponse(self.final_url, self.status_code, dict(self.headers), b"".join(kept),
+                                   self.encoding, redirects=self.redirects,
+                                   vary=vary_values(self.headers, self.request_headers))
+            if entry.is_storable():
+                response_cache.put(self.url, entry)
+                self.stored = entry
+
+    def header_report(self):
+        """HeaderReport for this GET; replayed cache entries only know status and URL of redirect hops"""
+        report = HeaderReport(self.url, "GET")
+        if self.response is not None:
+            for hop in self.response.history:
+                report.add_response(hop)
+            report.add_response(self.response)
+        else:
+            for status_code, hop_url in self.redirects:
+                report.add_hop(hop_url, status_code, {})
+            report.add_hop(self.final_url, self.status_code, self.headers)
+        return report
+
+    def abort(self):
+        """Shut the socket down so a read blocked on a trickling server returns now"""
+        connection = getattr(self.response.raw, "connection", None)
+        sock = getattr(connection, "sock", None)
+        if sock is not None:
+            sock.shutdown(socket.SHUT_RDWR)
+
+    def close(self):
+        if isinstance(self.cancel, CancelToken):
+            self.cancel.remove_callback(self.abort)
+        if self._chunks is not None:
+            self._chunks.close()
+        if self.response is not None:
+            self.response.close()
+
+
+def cached_get(url, html_only=False):
+    """GET url through the response cache.
+
+    Fresh entries are returned without touching the network, stale entries are
+    revalidated with If-None-Match / If-Modified-Since. With html_only, non-HTML
+    bodies are not downloaded and come back empty.
+    """
+    body = BodyStream(url, html_only=html_only)
+    if body.entry is not None:
+        return body.entry
+    content = b"".join(body)
+    return CachedResponse(body.final_url, body.status_code, dict(body.headers), content, body.encoding,
+                          redirects=body.redirects)
+
+
+# Parse throughput per backend, shown next to the cache counters
+parse_stats = {"stream": {"documents": 0, "bytes": 0, "seconds": 0.0},
+               "bs4": {"documents": 0, "bytes": 0, "seconds": 0.0}}
+parse_stats_lock = threading.Lock()
+
+
+def record_parse(backend, nbytes, seconds):
+    add_timing("parse", seconds)
+    with parse_stats_lock:
+        stats = parse_stats[backend]
+        stats["documents"] += 1
+        stats["bytes"] += nbytes
+        stats["seconds"] += seconds
+
+
+def parse_summary():
+    parts = []
+    with parse_stats_lock:
+        for backend, stats in parse_stats.items():
+            if stats["documents"]:
+                rate = stats["bytes"] / stats["seconds"] / (1024 * 1024) if stats["seconds"] else 0.0
+                parts.append(f"{backend} {rate:.1f} MB/s over {stats['documents']} docs")
+    return "Parse: " + (", ".join(parts) if parts else "no documents parsed yet")
+
+
+class StreamingExtractor(HTMLParser):
+    """Incremental HTML parser that queues link and text events as chunks are fed"""
+
+    skipped_tags = ("script", "style", "template")
+
+    def __init__(self, base_url, want_links=True, want_text=True):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.want_links = want_links
+        self.want_text = want_text
+        self.skip_depth = 0
+        self.events = deque()
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.skipped_tags:
+            self.skip_depth += 1
+        elif tag == "a" and self.want_links:
+            for name, value in attrs:
+                if name == "href" and value is not None:
+                    self.events.append(("link", urljoin(self.base_url, value)))
+                    break
+
+    def handle_endtag(self, tag):
+        if tag in self.skipped_tags and self.skip_depth:
+            self.skip_depth -= 1
+
+    def handle_data(self, data):
+        if self.want_text and not self.skip_depth:
+            self.events.append(("text", data))
+
+
+def iter_page_events(url, want_links=True, want_text=True, max_bytes=None, html_only=True):
+    """Yield ("link", url) and ("text", str) events while the body is still downloading.
+
+    Stop iterating at any time to abandon the rest of the body.
+    """
+    max_bytes = parse_max_bytes if max_bytes is None else max_bytes
+    return iter_body_events(BodyStream(url, max_bytes=max_bytes, html_only=html_only), url, want_links, want_text)
+
+
+def iter_body_events(body, base_url, want_links=True, want_text=True):
+    """Parse an open BodyStream incrementally, yielding link and text events"""
+    try:
+        try:
+            decoder = codecs.getincrementaldecoder(body.encoding or "utf-8")(errors="replace")
+        except LookupError:
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        parser = StreamingExtractor(base_url, want_links, want_text)
+        parse_seconds = 0.0
+        for chunk in body:
+            started = time.perf_counter()
+            parser.feed(decoder.decode(chunk))
+            parse_seconds += time.perf_counter() - started
+            while parser.events:
+                yield parser.events.popleft()
+        started = time.perf_counter()
+        parser.feed(decoder.decode(b"", final=True))
+        parser.close()
+        parse_seconds += time.perf_counter() - started
+        while parser.events:
+            yield parser.events.popleft()
+        record_parse("stream", body.bytes_read, parse_seconds)
+    finally:
+        body.close()
+
+
+def iter_links(url, max_bytes=None):
+    for kind, value in iter_page_events(url, want_text=False, max_bytes=max_bytes):
+        yield value
+
+
+def iter_text(url, max_bytes=None, html_only=False):
+    for kind, value in iter_page_events(url, want_links=False, max_bytes=max_bytes, html_only=html_only):
+        yield value
+
+
+def parse_soup(response):
+    """Parse a cached response with BeautifulSoup, recording parse time"""
+    started = time.perf_counter()
+    soup = BeautifulSoup(response.text, 'html.parser')
+    record_parse("bs4", len(response.content), time.perf_counter() - started)
+    return soup
+
+
+def soup_for(url, html_only=True):
+    return parse_soup(cached_get(url, html_only=html_only))
+
+
+def is_valid_url(url):
+    parsed = urlparse(url)
+    return bool(parsed.scheme and parsed.netloc)
+
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonicalize_url(url):
+    """Normalize a URL so trivially different spellings of one page compare equal.
+
+    Lower-cases scheme and host, drops default ports and the fragment, sorts
+    query parameters and gives an empty path "/". Percent-encoding is kept.
+    """
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    host = parsed.hostname or ""
+    if ":" in host:
+        host = f"[{host}]"
+    try:
+        port = parsed.port
+    except ValueError:
+        port = None
+    netloc = host if port is None or DEFAULT_PORTS.get(scheme) == port else f"{host}:{port}"
+    if "@" in parsed.netloc:
+        netloc = parsed.netloc.rpartition("@")[0] + "@" + netloc
+    query = "&".join(sorted(part for part in parsed.query.split("&") if part))
+    return urlunparse((scheme, netloc, parsed.path or "/", parsed.params, query, ""))
+
+
+def url_key(canonical_url):
+    """Dedup key of a canonical URL: /about and /about/ are the same page"""
+    parsed = urlparse(canonical_url)
+    if len(parsed.path) > 1 and parsed.path.endswith("/"):
+        return urlunparse(parsed._replace(path=parsed.path.rstrip("/") or "/"))
+    return canonical_url
+
+
+def in_scope(canonical_url, canonical_start):
+    """Same scheme and host as the start URL, and at or below its path"""
+    start = urlparse(canonical_start)
+    parsed = urlparse(canonical_url)
+    if (parsed.scheme, parsed.netloc) != (start.scheme, start.netloc):
+        return False
+    base = start.path.rstrip("/")
+    return not base or parsed.path == base or parsed.path.startswith(base + "/")
+
+
+class VisitedSet:
+    """Set of URL fingerprints in a flat open-addressing table (8 bytes per slot).
+
+    Stores 64-bit hashes instead of strings, so millions of URLs cost tens
+    of MB; two URLs sharing a hash (odds ~n^2 / 2^65) count as one.
+    """
+
+    def __init__(self, capacity=1024):
+        size = 1
+        while size < capacity * 2:
+            size *= 2
+        self.slots = array("Q", bytes(8 * size))
+        self.mask = size - 1
+        self.count = 0
+
+    def add(self, key):
+        """Add key; return True if it was not present"""
+        fingerprint = (hash(key) & 0xFFFFFFFFFFFFFFFF) or 1
+        index = fingerprint & self.mask
+        slots = self.slots
+        while slots[index]:
+            if slots[index] == fingerprint:
+                return False
+            index = (index + 1) & self.mask
+        slots[index] = fingerprint
+        self.count += 1
+        if self.count * 3 > len(slots) * 2:
+            self._grow()
+        return True
+
+    def _grow(self):
+        old = self.slots
+        self.slots = array("Q", bytes(16 * len(old)))
+        self.mask = len(self.slots) - 1
+        for fingerprint in old:
+            if fingerprint:
+                index = fingerprint & self.mask
+                while self.slots[index]:
+                    index = (index + 1) & self.mask
+                self.slots[index] = fingerprint
+
+    def __len__(self):
+        return self.count
+
+
+class BloomFilter:
+    """Fixed-size visited set sized for capacity keys at error_rate false positives.
+
+    Memory never grows, at the price of occasionally treating an unseen URL
+    as seen (it is then not crawled).
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def add(self, key):
+        """Add key; return True if it was (probably) not present"""
+        value = hash(key) & 0xFFFFFFFFFFFFFFFF
+        first, second = value & 0xFFFFFFFF, (value >> 32) | 1
+        new = False
+        for i in range(self.hashes):
+            bit = (first + i * second) % self.size
+            byte, mask = bit >> 3, 1 << (bit & 7)
+            if not self.bits[byte] & mask:
+                self.bits[byte] |= mask
+                new = True
+        self.count += new
+        return new
+
+    def __len__(self):
+        return self.count
+
+
+def new_visited_set():
+    if crawl_visited_mode == "bloom":
+        return BloomFilter(crawl_bloom_capacity, crawl_bloom_error_rate)
+    return VisitedSet()
+
+
+# Crawler settings
+crawl_incremental = True
+crawl_max_depth = 3
+crawl_max_workers = 16
+crawl_per_host_limit = 4
+crawl_max_frontier = 5000
+crawl_use_robots = True  # honour robots.txt Crawl-delay
+crawl_use_sitemaps = True  # list sitemap URLs as discovered pages
+crawl_fetch_sitemap_pages = True  # seed the frontier with them (up to sitemap_max_seeds per scan)
+sitemap_max_files = 50
+sitemap_max_urls = 50000
+sitemap_max_seeds = 1000
+sitemap_max_bytes = 50 * 1024 * 1024  # per sitemap, compressed and uncompressed (the protocol's own limit)
+sitemap_scan_max_bytes = 100 * 1024 * 1024  # all sitemaps of one scan together
+# "bloom" caps the visited set on multi-million URL crawls; page lists and incremental records still grow
+# with the crawl unless it streams through on_row with collect off (export)
+crawl_visited_mode = "exact"
+crawl_bloom_capacity = 10_000_000
+crawl_bloom_error_rate = 0.001
+
+
+def fetch_page_record(url, previous=None):
+    """Fetch one page for the crawler and return its crawl record.
+
+    The record holds status code, validators, a hash of the body, the absolute
+    URLs of its <a href> links and a state of new, changed or unchanged
+    relative to previous. When previous is given the request is conditional,
+    and a 304 reuses the stored links without downloading the page.
+    """
+    validators = previous if previous is not None and previous["status_code"] == 200 else None
+    body = BodyStream(url, max_bytes=parse_max_bytes, html_only=True, validators=validators)
+    if body.not_modified:
+        body.close()
+        return dict(previous, state="unchanged", headers=body.headers)
+    body.digest = hashlib.sha1()
+    if html_parser_backend == "bs4":
+        try:
+            content = b"".join(body)
+        finally:
+            body.close()
+        soup = parse_soup(CachedResponse(body.final_url, body.status_code, {}, content, body.encoding))
+        links = [urljoin(url, link['href']) for link in soup.find_all('a', href=True)]
+    else:
+        links = [value for kind, value in iter_body_events(body, url, want_text=False)]
+    record = {"status_code": body.status_code, "etag": body.headers.get("ETag"),
+              "last_modified": body.headers.get("Last-Modified"), "hash": body.digest.hexdigest(), "links": links,
+              "headers": body.headers}
+    if previous is None or previous["status_code"] is None:
+        record["state"] = "new"
+    elif (previous["status_code"], previous["hash"]) == (record["status_code"], record["hash"]):
+        record["state"] = "unchanged"
+    else:
+        record["state"] = "changed"
+    return record
+
+
+def fetch_page_links(url):
+    """Fetch one page and return its status code and the absolute URLs of its <a href> links"""
+    record = fetch_page_record(url)
+    return record["status_code"], record["links"]
+
+
+def timed_fetch_page_record(url, previous=None):
+    started = time.monotonic()
+    record = fetch_page_record(url, previous)
+    return record, time.monotonic() - started
+
+
+class RobotRules(RobotFileParser):
+    """RobotFileParser that also reads fractional Crawl-delay values; the stdlib only accepts whole seconds"""
+
+    def parse(self, lines):
+        lines = list(lines)
+        super().parse(lines)
+        # (user agents, Crawl-delay) per group, in file order
+        self.delays = []
+        agents = []
+        delay = None
+        in_rules = False
+        for line in lines:
+            field, _, value = line.split("#", 1)[0].partition(":")
+            field = field.strip().lower()
+            value = value.strip()
+            if field == "user-agent":
+                if in_rules:
+                    self.delays.append((agents, delay))
+                    agents, delay, in_rules = [], None, False
+                agents.append(value.lower())
+            elif field in ("allow", "disallow", "crawl-delay", "request-rate") and agents:
+                in_rules = True
+                if field == "crawl-delay":
+                    try:
+                        seconds = float(value)
+                    except ValueError:
+                        continue
+                    if math.isfinite(seconds) and seconds >= 0:
+                        delay = seconds
+        if agents:
+            self.delays.append((agents, delay))
+
+    def crawl_delay(self, useragent):
+        # Matched like the stdlib: a group naming part of our product token wins over the * group
+        token = useragent.split("/")[0].lower()
+        default = None
+        for agents, delay in self.delays:
+            if any(agent != "*" and agent in token for agent in agents):
+                return delay
+            if "*" in agents and default is None:
+                default = delay
+        return default
+
+
+def fetch_robots(start_url):
+    """Fetch and parse /robots.txt of start_url's site; None when there is none"""
+    parsed = urlparse(start_url)
+    response = cached_get(f"{parsed.scheme}://{parsed.netloc}/robots.txt")
+    if response.status_code != 200:
+        return None
+    robots = RobotRules()
+    robots.parse(response.text.splitlines())
+    return robots
+
+
+def iter_sitemap_entries(url, budget=None):
+    """Stream one sitemap or sitemap index, plain or gzipped, yielding ("url" | "sitemap", loc).
+
+    The body bypasses the response cache and is capped at sitemap_max_bytes
+    (and at budget["bytes"], which is reduced by what was read).
+    """
+    max_bytes = sitemap_max_bytes if budget is None else min(sitemap_max_bytes, budget["bytes"])
+    body = BodyStream(url, max_bytes=max_bytes, cache=False)
+    try:
+        if body.status_code != 200 or body.skipped:
+            return
+        parser = ElementTree.XMLPullParser(events=("start", "end"))
+        inflate = None
+        inflated = 0
+        path = []
+        root_element = None
+        for chunk in body:
+            if inflate is None:
+                # .gz sitemaps arrive as raw gzip; Content-Encoding: gzip was already undone by requests
+                inflate = zlib.decompressobj(16 + zlib.MAX_WBITS) if chunk[:2] == b"\x1f\x8b" else False
+            if inflate:
+                chunk = inflate.decompress(chunk, sitemap_max_bytes - inflated)
+                inflated += len(chunk)
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                tag = element.tag.rpartition("}")[2]
+                if event == "start":
+                    if root_element is None:
+                        root_element = element
+                    path.append(tag)
+                    continue
+                path.pop()
+                if tag == "loc" and path and path[-1] in ("url", "sitemap") and element.text:
+                    yield path[-1], element.text.strip()
+                elif tag in ("url", "sitemap") and len(path) == 1:
+                    # Drop finished entries so a 50,000-URL sitemap is never held in memory
+                    root_element.clear()
+            if inflated >= sitemap_max_bytes:
+                log_crash(f"Sitemap over {sitemap_max_bytes} bytes uncompressed, rest skipped", url=url)
+                break
+    finally:
+        body.close()
+        if budget is not None:
+            budget["bytes"] -= body.bytes_read
+
+
+def iter_sitemap_urls(start_url, robots=None):
+    """Page URLs from the sitemaps named in robots.txt (or /sitemap.xml), following sitemap indexes"""
+    parsed = urlparse(start_url)
+    pending = deque((robots.site_maps() if robots is not None else None)
+                    or [f"{parsed.scheme}://{parsed.netloc}/sitemap.xml"])
+    visited = set()
+    count = 0
+    budget = {"bytes": sitemap_scan_max_bytes}
+    while pending and len(visited) < sitemap_max_files and budget["bytes"] > 0:
+        sitemap_url = pending.popleft()
+        if sitemap_url in visited:
+            continue
+        visited.add(sitemap_url)
+        try:
+            for kind, loc in iter_sitemap_entries(sitemap_url, budget):
+                if kind == "sitemap":
+                    pending.append(urljoin(sitemap_url, loc))
+                    continue
+                yield urljoin(sitemap_url, loc)
+                count += 1
+                if count >= sitemap_max_urls:
+                    return
+        except (ElementTree.ParseError, zlib.error) as e:
+            log_crash(f"Sitemap parse error for {sitemap_url}: {str(e)}", url=sitemap_url)
+
+
+def crawl_seeds(start_url, max_depth=None):
+    """robots.txt Crawl-delay and in-scope sitemap URLs for start_url; failures fall back to plain crawling.
+
+    A crawl of the start page alone (max_depth 1) makes no further requests,
+    so neither robots.txt nor the sitemaps are downloaded for it.
+    """
+    robots = None
+    delay = None
+    sitemap_urls = set()
+    if max_depth is not None and max_depth <= 1:
+        return delay, sitemap_urls
+    try:
+        if crawl_use_robots or crawl_use_sitemaps:
+            robots = fetch_robots(start_url)
+        if crawl_use_robots and robots is not None:
+            delay = robots.crawl_delay(http_headers["User-Agent"])
+        if crawl_use_sitemaps:
+            start = canonicalize_url(start_url)
+            sitemap_urls = {canonical for canonical in map(canonicalize_url, iter_sitemap_urls(start_url, robots))
+                            if in_scope(canonical, start)}
+    except JobCancelled:
+        raise
+    except Exception as e:
+        log_crash(f"robots.txt/sitemap error for {start_url}: {str(e)}", url=start_url)
+    return float(delay) if delay else None, sitemap_urls
+
+
+def page_row(scan_url, url, kind, depth, record=None, elapsed=None, error=None):
+    """One export row for a crawled URL; URLs that were only discovered have no record"""
+    headers = (record or {}).get("headers") or {}
+    if error is not None:
+        state = "error"
+    else:
+        state = record["state"] if record else "discovered"
+    return {"scan": scan_url, "url": url, "kind": kind, "depth": depth,
+            "status_code": record["status_code"] if record else None, "state": state,
+            "elapsed_ms": round(elapsed * 1000, 1) if elapsed is not None else None,
+            "content_type": headers.get("Content-Type"), "content_length": headers.get("Content-Length"),
+            "etag": record["etag"] if record else None, "last_modified": record["last_modified"] if record else None,
+            "error": str(error) if error is not None else None, "headers": dict(headers)}
+
+
+def crawl_site(start_url, max_depth=None, max_workers=None, per_host_limit=None, max_frontier=None,
+               on_page=None, previous=None, records=None, on_row=None, collect=True):
+    """Breadth-first crawl of start_url using a worker pool.
+
+    Links found on the start page are returned as pages, links only reachable
+    deeper in the site are returned as hidden pages. Errors on the start page
+    are raised, errors on deeper pages are logged and skipped. on_page, if
+    given, is called as on_page(url, depth, status_code, elapsed, error) for
+    every fetch. previous holds crawl records of an earlier scan for
+    conditional requests, and records (a dict) receives this crawl's records.
+    URLs listed in the site's sitemaps count as hidden pages unless linked
+    from the start page, and a robots.txt Crawl-delay spaces the requests.
+
+    on_row, if given, receives a page_row for every fetched page and every
+    URL found but not fetched, as the crawl goes. With collect off no page
+    sets are built (empty sets are returned), so a crawl streamed through
+    on_row uses memory bounded by the visited set.
+    """
+    max_depth = crawl_max_depth if max_depth is None else max_depth
+    max_workers = crawl_max_workers if max_workers is None else max_workers
+    per_host_limit = crawl_per_host_limit if per_host_limit is None else per_host_limit
+    max_frontier = crawl_max_frontier if max_frontier is None else max_frontier
+    delay, sitemap_urls = crawl_seeds(start_url, max_depth)
+    start_url = canonicalize_url(start_url)
+    start_key = url_key(start_url)
+
+    # Keyed by url_key so slash variants collapse; values are the URLs reported
+    pages = {}
+    hidden_pages = {}
+    seen = new_visited_set()
+    seen.add(start_key)
+    # One FIFO per host so a busy host never blocks the others
+    host_queues = {urlparse(start_url).netloc: deque([(start_url, 0, "start")])}
+    host_active = {}
+    frontier_size = 1
+    metrics.adjust_gauge("frontier", 1)
+    if crawl_fetch_sitemap_pages and max_depth > 1:
+        for page_url in sorted(sitemap_urls):
+            if frontier_size >= min(max_frontier, sitemap_max_seeds + 1):
+                break
+            if seen.add(url_key(page_url)):
+                host_queues.setdefault(urlparse(page_url).netloc, deque()).append((page_url, 1, "hidden"))
+                frontier_size += 1
+        metrics.adjust_gauge("frontier", frontier_size - 1)
+    if max_depth > 1:
+        # Connect ahead of the fetch workers, but never more than the host has queued pages for
+        for host, host_queue in host_queues.items():
+            prefetcher.warm(host_queue[0][0], min(per_host_limit, len(host_queue)))
+    in_flight = {}
+    previous = previous or {}
+    limiter = HostRateLimiter(1.0 / delay) if delay else None
+
+    def fetch(page_url, host, previous_record):
+        if limiter is not None:
+            limiter.wait(host)
+        return timed_fetch_page_record(page_url, previous_record)
+    fetch_in_context = bind_command_context(fetch)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            while frontier_size or in_flight:
+                check_cancelled()
+                for host in list(host_queues):
+                    host_queue = host_queues[host]
+                    while host_queue and len(in_flight) < max_workers and host_active.get(host, 0) < per_host_limit:
+                        page_url, depth, kind = host_queue.popleft()
+                        frontier_size -= 1
+                        metrics.adjust_gauge("frontier", -1)
+                        host_active[host] = host_active.get(host, 0) + 1
+                        future = pool.submit(fetch_in_context, page_url, host, previous.get(page_url))
+                        in_flight[future] = (page_url, depth, kind, host)
+                    if not host_queue:
+                        del host_queues[host]
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    page_url, depth, kind, host = in_flight.pop(future)
+                    host_active[host] -= 1
+                    try:
+                        record, elapsed = future.result()
+                    except Exception as e:
+                        if on_page is not None:
+                            on_page(page_url, depth, None, None, e)
+                        if on_row is not None:
+                            on_row(page_row(start_url, page_url, kind, depth, error=e))
+                        if depth == 0:
+                            raise
+                        log_crash(f"Crawl error for {page_url}: {str(e)}", url=page_url)
+                        continue
+                    status_code = record["status_code"]
+                    if on_row is not None:
+                        on_row(page_row(start_url, page_url, kind, depth, record, elapsed))
+                    # Headers only feed the export row; stored records stay small
+                    record.pop("headers", None)
+                    if records is not None:
+                        records[page_url] = record
+                    if on_page is not None:
+                        on_page(page_url, depth, status_code, elapsed, None)
+                    link_kind = "page" if depth == 0 else "hidden"
+                    for link in record["links"]:
+                        full_url = canonicalize_url(link)
+                        if not in_scope(full_url, start_url):
+                            continue
+                        key = url_key(full_url)
+                        if collect:
+                            new = key != start_key and key not in pages and key not in hidden_pages
+                            (pages if depth == 0 else hidden_pages).setdefault(key, full_url)
+                        if depth + 1 < max_depth:
+                            if not seen.add(key):
+                                continue
+                            if frontier_size < max_frontier:
+                                link_host = urlparse(full_url).netloc
+                                host_queues.setdefault(link_host, deque()).append((full_url, depth + 1, link_kind))
+                                frontier_size += 1
+                                metrics.adjust_gauge("frontier", 1)
+                                continue
+                        elif not (new if collect else seen.add(key)):
+                            continue
+                        # Found but never fetched: too deep or the frontier is full
+                        if on_row is not None:
+                            on_row(page_row(start_url, full_url, link_kind, depth + 1))
+    finally:
+        # Whatever is still queued when the crawl stops (error or cancel) leaves the gauge too
+        metrics.adjust_gauge("frontier", -frontier_size)
+    for page_url in sorted(sitemap_urls):
+        key = url_key(page_url)
+        found = key in pages or key in hidden_pages
+        if collect:
+            hidden_pages.setdefault(key, page_url)
+        # Sitemap URLs already fetched or found through links have their row
+        if seen.add(key) and not found and on_row is not None:
+            on_row(page_row(start_url, page_url, "hidden", None))
+    hidden_pages.pop(start_key, None)
+    return (set(pages.values()),
+            {page_url for key, page_url in hidden_pages.items() if key not in pages})
+
+
+def scan_domain(url, max_depth=None, max_workers=None, on_row=None, collect=True):
+    """Crawl url and return a result dict with pages, hidden pages, status codes, error and elapsed time.
+
+    With crawl_incremental on, the previous crawl of url is reused for
+    conditional requests and result["diff"] lists new, removed and changed pages.
+    on_row and collect are passed to crawl_site; without collect the result
+    has no page lists and the crawl is not stored for incremental rescans.
+    """
+    started = time.monotonic()
+    result = {"url": url, "pages": [], "hidden_pages": [], "status_code": None, "status_counts": {},
+              "pages_fetched": 0, "error": None, "diff": None}
+    previous = load_previous_crawl(url) if collect else None
+    records = {} if collect else None
+
+    def on_page(page_url, depth, status_code, elapsed, error):
+        if depth == 0:
+            result["status_code"] = status_code
+        key = str(status_code) if status_code is not None else "error"
+        result["status_counts"][key] = result["status_counts"].get(key, 0) + 1
+        result["pages_fetched"] += 1
+
+    try:
+        pages, hidden_pages = crawl_site(url, max_depth=max_depth, max_workers=max_workers, on_page=on_page,
+                                         previous=previous, records=records, on_row=on_row, collect=collect)
+        result["pages"] = sorted(pages)
+        result["hidden_pages"] = sorted(hidden_pages)
+        if crawl_incremental and collect:
+            discovered = pages | hidden_pages | {canonicalize_url(url)}
+            if previous:
+                result["diff"] = crawl_diff(previous, records, discovered)
+            store_crawl(url, records, discovered)
+    except requests.exceptions.Timeout:
+        log_crash(f"Timeout scanning {url}", url=url)
+        result["error"] = "Error: Connection timeout. Website might be slow or unavailable."
+    except requests.exceptions.ConnectionError:
+        log_crash(f"Connection error scanning {url}", url=url)
+        result["error"] = "Error: Cannot connect to website. Check internet connection."
+    except Exception as e:
+        log_crash(f"Scan error: {str(e)}", url=url)
+        result["error"] = "Error: Unable to scan website. Continuing safely."
+    result["elapsed"] = round(time.monotonic() - started, 3)
+    return result
+
+
+def load_previous_crawl(url):
+    if not crawl_incremental:
+        return None
+    try:
+        return canonical_crawl_state(load_crawl_state(url))
+    except Exception as e:
+        log_crash(f"Crawl state read error: {str(e)}", url=url)
+        return None
+
+
+def canonical_crawl_state(state):
+    """Key stored records by canonical URL, as crawl_site does; crawls stored before canonicalization used raw URLs.
+
+    When several stored URLs collapse into one, a fetched record wins over a discovered-only one.
+    """
+    canonical = {}
+    for page_url, record in state.items():
+        key = canonicalize_url(page_url)
+        if key not in canonical or canonical[key]["status_code"] is None:
+            canonical[key] = record
+    return canonical
+
+
+def store_crawl(url, records, discovered):
+    try:
+        save_crawl_state(url, records, discovered)
+    except Exception as e:
+        log_crash(f"Crawl state write error: {str(e)}", url=url)
+
+
+def crawl_diff(previous, records, discovered):
+    """New and removed URLs against the previous crawl, plus fetched pages whose status or content changed"""
+    unchanged = sum(1 for record in records.values() if record["state"] == "unchanged")
+    return {"new": sorted(discovered - previous.keys()),
+            "removed": sorted(previous.keys() - discovered),
+            "changed": sorted(page for page, record in records.items() if record["state"] == "changed"),
+            "unchanged": unchanged}
+
+
+def scan_website(url, progress_bar=None):
+    if progress_bar is not None:
+        ui_post(progress_bar.start)
+    try:
+        result = scan_domain(url)
+    finally:
+        if progress_bar is not None:
+            ui_post(progress_bar.stop)
+    if result["error"]:
+        return set(), {result["error"]}
+    return set(result["pages"]), set(result["hidden_pages"])
+
+
+# Scan export settings
+export_flush_rows = 500
+EXPORT_FIELDS = ("scan", "url", "kind", "depth", "status_code", "state", "elapsed_ms", "content_type",
+                 "content_length", "etag", "last_modified", "error", "headers")
+
+
+class ScanExporter:
+    """Writes crawl rows to a JSON Lines or CSV file (by extension) as they arrive.
+
+    Nothing is buffered beyond the file's own buffer, so memory stays flat
+    however large the crawl; write is locked so concurrent scans can share
+    one exporter. Rows arriving after close (from a scan abandoned at its
+    deadline) are dropped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        self.file = open(path, "w", encoding="utf-8", newline="")
+        self.writer = None
+        if path.lower().endswith(".csv"):
+            self.writer = csv.DictWriter(self.file, fieldnames=EXPORT_FIELDS)
+            self.writer.writeheader()
+
+    def write(self, row):
+        with self.lock:
+            if self.closed:
+                return
+            if self.writer is not None:
+                self.writer.writerow(dict(row, headers=json.dumps(row["headers"])))
+            else:
+                self.file.write(json.dumps(row) + "\n")
+            self.rows += 1
+            if self.rows % export_flush_rows == 0:
+                self.file.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.closed:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.file.close()
+
+
+def default_export_path(url):
+    host = urlparse(url).netloc.replace(":", "_") or "scan"
+    return f"scan_export_{host}_{time.strftime('%Y%m%d_%H%M%S')}.jsonl"
+
+
+def process_export_path(path, pid):
+    root_path, extension = os.path.splitext(path)
+    return f"{root_path}.{pid}{extension}"
+
+
+def export_scan(url, path):
+    """Crawl url, streaming every page to path; returns the scan result and the number of rows written"""
+    exporter = ScanExporter(path)
+    try:
+        result = scan_domain(url, on_row=exporter.write)
+    finally:
+        exporter.close()
+    record_scan(result)
+    return result, exporter.rows
+
+
+# Batch scanning settings
+batch_workers = 8
+batch_crawl_depth = 1
+batch_crawl_workers = 4
+batch_domain_deadline = 120  # seconds before one domain's scan is abandoned, 0 for none
+batch_processes = 0  # >1 shards domains across that many processes
+batch_shard_size = 16
+
+
+def normalize_domain(line):
+    """Turn a line from a domain list into a URL, or None for blanks and comments"""
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    if "://" not in line:
+        line = "https://" + line
+    return line
+
+
+def scan_with_deadline(url, max_depth=None, max_workers=None, deadline=None, on_row=None):
+    """scan_domain, returning an error result once deadline seconds have passed.
+
+    The scan runs on its own thread: a site trickling bytes can block a read
+    for far longer than the deadline, so the caller stops waiting and the
+    scan is told to stop at its next checkpoint.
+    """
+    deadline = batch_domain_deadline if deadline is None else deadline
+    # Exported pages are not listed in the result as well, keeping batch memory flat
+    collect = on_row is None
+    if not deadline:
+        return scan_domain(url, max_depth, max_workers, on_row, collect)
+    cancel = CancelToken()
+    finished = threading.Event()
+    outcome = {}
+
+    def run():
+        command_context.cancel = cancel
+        try:
+            outcome["result"] = scan_domain(url, max_depth, max_workers, on_row, collect)
+        except JobCancelled:
             pass
+        finally:
+            finished.set()
+    threading.Thread(target=bind_command_context(run), daemon=True).start()
+    if finished.wait(deadline) and "result" in outcome:
+        return outcome["result"]
+    cancel.set()
+    log_crash(f"Scan deadline of {deadline:g}s exceeded", url=url)
+    result = failed_result(url, f"Error: Scan exceeded the {deadline:g}s deadline.")
+    result["elapsed"] = deadline
+    return result
+
+
+def failed_result(url, error):
+    return {"url": url, "pages": [], "hidden_pages": [], "status_code": None, "status_counts": {},
+            "pages_fetched": 0, "error": error, "diff": None, "elapsed": None}
+
+
+def scan_domains(urls, workers=None, max_depth=None, deadline=None, on_row=None):
+    """Scan many URLs concurrently, yielding result dicts as each one finishes.
+
+    urls may be any iterable (e.g. an open file); at most a few times the
+    worker count are read ahead so huge lists stay in bounded memory. With
+    on_row the pages go only to on_row, not into the results.
+    """
+    workers = batch_workers if workers is None else workers
+    max_depth = batch_crawl_depth if max_depth is None else max_depth
+    urls = iter(urls)
+    in_flight = set()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            for url in urls:
+                in_flight.add(pool.submit(scan_with_deadline, url, max_depth, batch_crawl_workers, deadline, on_row))
+                # A domain read ahead waits for a worker; resolve and connect to it meanwhile. One that starts
+                # at once would race its own scan for the connection, and a depth-1 scan needs only one.
+                if len(in_flight) > workers and max_depth > 1:
+                    prefetcher.warm(url)
+                if len(in_flight) >= workers * 2:
+                    break
+            if not in_flight:
+                return
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+# Multi-process scanning: settings copied into every shard process
+SHARD_SETTINGS = ("http_timeout", "http_retries", "http_backoff", "http_pool_size", "http_headers",
+                  "crawl_incremental", "crawl_max_depth", "crawl_max_workers", "crawl_per_host_limit",
+                  "crawl_max_frontier", "crawl_use_robots", "crawl_use_sitemaps", "crawl_fetch_sitemap_pages",
+                  "crawl_visited_mode", "crawl_bloom_capacity", "crawl_bloom_error_rate",
+                  "sitemap_max_files", "sitemap_max_urls", "sitemap_max_seeds", "sitemap_max_bytes",
+                  "sitemap_scan_max_bytes", "cache_max_bytes", "cache_fresh_seconds", "cache_dir",
+                  "cache_disk_max_bytes", "stream_chunk_size", "html_parser_backend", "parse_max_bytes",
+                  "history_db_path", "crash_log_path", "batch_crawl_workers", "batch_domain_deadline")
+shard_results = None
+shard_exporter = None
+
+
+def init_shard_process(results, settings, export_path=None):
+    global shard_results, response_cache, shard_exporter
+    shard_results = results
+    globals().update(settings)
+    # The cache was built from the defaults when this process imported the module
+    response_cache = ResponseCache(cache_max_bytes, cache_dir, cache_disk_max_bytes)
+    if export_path:
+        # One file per process however many shards it scans; pool workers skip atexit, so close via a finalizer
+        shard_exporter = ScanExporter(process_export_path(export_path, os.getpid()))
+        Finalize(shard_exporter, shard_exporter.close, exitpriority=10)
+
+
+def scan_shard(shard_id, urls, workers, max_depth, deadline):
+    """Scan one shard with its own thread pool, sending each result to the parent; returns the count sent
+
+    Pages go to this process's exporter when the pool was started with an export path.
+    """
+    count = 0
+    try:
+        for result in scan_domains(urls, workers, max_depth, deadline,
+                                   shard_exporter.write if shard_exporter else None):
+            shard_results.put((shard_id, result))
+            count += 1
+    finally:
+        if shard_exporter is not None:
+            shard_exporter.flush()
+    return count
+
+
+def scan_domains_sharded(urls, processes=None, workers=None, max_depth=None, deadline=None, shard_size=None,
+                         export_path=None):
+    """Scan many URLs across a process pool, yielding result dicts as each domain finishes.
+
+    URLs are cut into shards of shard_size; every process scans its shard
+    with its own thread pool, so parsing uses several cores and a slow site
+    holds up only its own shard. A crashed shard yields error results for
+    the domains it had not reported; when a dead worker breaks the pool,
+    the shards then in flight fail that way and the rest go to a new pool.
+    With export_path every process streams its pages to a file of its own
+    (see process_export_path).
+    """
+    processes = batch_processes if processes is None else processes
+    workers = batch_workers if workers is None else workers
+    shard_size = batch_shard_size if shard_size is None else shard_size
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    settings = {name: globals()[name] for name in SHARD_SETTINGS}
+    urls = iter(urls)
+    shards = {}
+    expected = {}
+    received = {}
+    next_shard = 0
+
+    def new_pool():
+        return ProcessPoolExecutor(max_workers=processes, mp_context=context,
+                                   initializer=init_shard_process, initargs=(results, settings, export_path))
+    pool = new_pool()
+    in_flight = {}
+    try:
+        while True:
+            while len(in_flight) < processes * 2:
+                shard = [url for _, url in zip(range(shard_size), urls)]
+                if not shard:
+                    break
+                # Counted per URL: a list may name the same domain twice and each copy reports a result
+                shards[next_shard] = Counter(shard)
+                received[next_shard] = 0
+                args = (scan_shard, next_shard, shard, workers, max_depth, deadline)
+                try:
+                    future = pool.submit(*args)
+                except BrokenProcessPool:
+                    # A worker died: the futures still in flight fail below, new shards go to a fresh pool
+                    log_crash("Scan process pool broken, starting a new one")
+                    pool.shutdown(wait=False)
+                    pool = new_pool()
+                    future = pool.submit(*args)
+                in_flight[future] = next_shard
+                next_shard += 1
+            if not in_flight and not shards:
+                return
+            try:
+                shard_id, result = results.get(timeout=0.2)
+                # Results of a shard already given up on were reported as failures
+                if shard_id in shards and shards[shard_id][result["url"]] > 0:
+                    received[shard_id] += 1
+                    shards[shard_id][result["url"]] -= 1
+                    yield result
+            except queue.Empty:
+                pass
+            for future in [future for future in in_flight if future.done()]:
+                shard_id = in_flight.pop(future)
+                try:
+                    expected[shard_id] = future.result()
+                except Exception as e:
+                    log_crash(f"Scan shard {shard_id} failed: {str(e)}")
+                    expected[shard_id] = received[shard_id]
+                    for url in sorted(shards[shard_id].elements()):
+                        yield failed_result(url, "Error: Scan process failed. Continuing safely.")
+                    shards[shard_id].clear()
+            # A shard is finished once its future is done and all of its queued results arrived
+            for shard_id in [shard_id for shard_id, count in expected.items() if received[shard_id] >= count]:
+                del expected[shard_id], shards[shard_id], received[shard_id]
+    finally:
+        pool.shutdown()
+
+
+HTTP_VERSIONS = {9: "HTTP/0.9", 10: "HTTP/1.0", 11: "HTTP/1.1", 20: "HTTP/2"}
+
+
+class HeaderReport:
+    """Status line and headers of every response in a request's redirect chain"""
+
+    def __init__(self, url, method):
+        self.url = url
+        self.method = method
+        self.hops = []
+
+    def add_hop(self, url, status_code, headers, reason=None, http_version="HTTP/1.1", elapsed=None):
+        self.hops.append({
+            "url": url,
+            "status_code": status_code,
+            "reason": reason if reason is not None else http.client.responses.get(status_code, ""),
+            "http_version": http_version,
+            "headers": headers,
+            "elapsed": elapsed,
+        })
+
+    def add_response(self, response):
+        raw_version = getattr(response.raw, "version", None)
+        self.add_hop(response.url, response.status_code, response.headers, response.reason or "",
+                     HTTP_VERSIONS.get(raw_version, "HTTP/1.1"), response.elapsed.total_seconds())
+
+    @property
+    def final(self):
+        return self.hops[-1] if self.hops else None
 
+    @property
+    def redirect_chain(self):
+        return [(hop["status_code"], hop["url"]) for hop in self.hops]
 
-def is_valid_url(url):
-    parsed = urlparse(url)
-    return bool(parsed.scheme and parsed.netloc)
+    def as_dict(self):
+        return {"url": self.url, "method": self.method,
+                "hops": [dict(hop, headers=dict(hop["headers"])) for hop in self.hops]}
+
+    def render_curl(self):
+        """Render like `curl -I -L`: one status line and header block per hop"""
+        blocks = []
+        for hop in self.hops:
+            lines = [f"{hop['http_version']} {hop['status_code']} {hop['reason']}".rstrip()]
+            lines += [f"{name}: {value}" for name, value in hop["headers"].items()]
+            blocks.append("\n".join(lines) + "\n")
+        return "\n".join(blocks)
 
 
-def scan_website(url, progress_bar):
-    pages = set()
-    hidden_pages = set()
+def fetch_headers(url, method="HEAD", follow_redirects=True):
+    """Send method to url in-process and return a HeaderReport of the redirect chain"""
+    response = http_request(method, url, allow_redirects=follow_redirects, stream=True)
     try:
-        progress_bar.start()
-        time.sleep(2)
-        progress_bar.stop()
-    except Exception as e:
-        log_crash(f"Progress bar error: {str(e)}")
-    
-    try:
-        response = requests.get(url, timeout=5)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        for link in soup.find_all('a', href=True):
-            full_url = urljoin(url, link['href'])
-            if url in full_url:
-                pages.add(full_url)
-            elif full_url.startswith('/'):
-                hidden_pages.add(urljoin(url, full_url[1:]))
-        return pages, hidden_pages
-    except requests.exceptions.Timeout:
-        log_crash(f"Timeout scanning {url}")
-        return set(), {"Error: Connection timeout. Website might be slow or unavailable."}
-    except requests.exceptions.ConnectionError:
-        log_crash(f"Connection error scanning {url}")
-        return set(), {"Error: Cannot connect to website. Check internet connection."}
-    except Exception as e:
-        log_crash(f"Scan error: {str(e)}")
-        return set(), {f"Error: Unable to scan website. Continuing safely."}
+        report = HeaderReport(url, method)
+        for hop in response.history:
+            report.add_response(hop)
+        report.add_response(response)
+        return report
+    finally:
+        response.close()
 
 
 def analyze_stream(url):
     try:
-        result = subprocess.check_output(['curl', '-I', url], timeout=5).decode()
-        return f"Headers:\n{result}"
-    except subprocess.TimeoutExpired:
-        log_crash(f"Curl timeout for {url}")
+        return f"Headers:\n{fetch_headers(url).render_curl()}"
+    except requests.exceptions.Timeout:
+        log_crash(f"Header request timeout for {url}")
         return "Error: Request timed out. Website not responding."
-    except FileNotFoundError:
-        log_crash("Curl not found")
-        try:
-            response = requests.head(url, timeout=5)
-            headers = "\n".join([f"{k}: {v}" for k, v in response.headers.items()])
-            return f"Headers (using alternative method):\n{headers}"
-        except:
-            return "Error: Cannot analyze headers. Tool unavailable."
+    except requests.exceptions.ConnectionError:
+        log_crash(f"Header request connection error for {url}")
+        return "Error: Cannot connect to website. Check URL or internet connection."
     except Exception as e:
         log_crash(f"Analyze stream error: {str(e)}")
         return "Error: Unable to analyze stream. Continuing safely."
@@ -256,16 +2751,191 @@ def set_dark_theme():
     save_theme()
 
 
+def toggle_typewriter():
+    global typewriter_effect
+    typewriter_effect = not typewriter_effect
+    typewriter(f"Typewriter effect for banners: {'On' if typewriter_effect else 'Off'}", output)
+
+
 def toggle_truncation():
     global truncate_backend
     truncate_backend = not truncate_backend
     typewriter(f"Truncate backend code: {'On' if truncate_backend else 'Off'}", output)
 
 
+# Preview settings
+backend_preview_bytes = 1000
+frontend_max_bytes = 2 * 1024 * 1024
+preview_use_range = True
+
+
+def fetch_preview(url, limit):
+    """Read at most limit bytes of url, using a Range request when the server honours it.
+
+    Returns (text, bytes_shown, total_bytes, truncated); total_bytes is None when unknown.
+    """
+    body = BodyStream(url, max_bytes=limit, use_range=preview_use_range)
+    try:
+        content = b"".join(body)
+    finally:
+        body.close()
+    total = body.total_bytes
+    truncated = body.truncated if total is None else body.bytes_read < total
+    return content.decode(body.encoding or "utf-8", errors="replace"), body.bytes_read, total, truncated
+
+
+def truncation_note(text, shown, total):
+    total_text = f"{total:,}" if total is not None else "?"
+    return f"{text}\n... (truncated: showing {shown:,} of {total_text} bytes)"
+
+
+def format_preview(url, limit):
+    text, shown, total, truncated = fetch_preview(url, limit)
+    if not truncated:
+        return text
+    return truncation_note(text, shown, total)
+
+
+# Parsed documents per target URL, kept until the reload command drops them
+document_max_bytes = 20 * 1024 * 1024
+document_max_entries = 8
+documents = OrderedDict()
+document_lock = threading.Lock()
+
+
+class TargetDocument:
+    """The target URL's page; every view of it is computed on first use and reused until the page is reloaded"""
+
+    def __init__(self, url):
+        self.url = url
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.entry = None
+        self._decoded = None
+        self._tree = None
+        self._text = None
+        self._links = None
+
+    def load(self):
+        """Fetch the page through the response cache, keeping the parsed views when it has not changed"""
+        with self.lock:
+            body = BodyStream(self.url, max_bytes=document_max_bytes)
+            try:
+                if self.loaded and body.entry is not None and body.entry is self.entry:
+                    # Still fresh, or revalidated with a 304
+                    return self
+                if body.entry is not None and len(body.entry.content) <= document_max_bytes:
+                    raw = body.entry.content
+                else:
+                    raw = b"".join(body)
+            finally:
+                body.close()
+            self.entry = body.entry or body.stored
+            self.raw = raw
+            self._decoded = self._tree = self._text = self._links = None
+            self.status_code = body.status_code
+            self.headers = body.headers
+            self.encoding = body.encoding or "utf-8"
+            self.final_url = body.final_url
+            self.redirect_chain = list(body.redirects)
+            total = body.total_bytes
+            # A read that stops exactly at the limit only shows as truncated against the known total
+            self.truncated = body.truncated if total is None else len(self.raw) < total
+            self.total_bytes = total if self.truncated else len(self.raw)
+            self.loaded = True
+            return self
+
+    def ensure_loaded(self):
+        with self.lock:
+            return self if self.loaded else self.load()
+
+    @property
+    def decoded(self):
+        with self.lock:
+            if self._decoded is None:
+                self._decoded = self.ensure_loaded().raw.decode(self.encoding, errors="replace")
+            return self._decoded
+
+    @property
+    def tree(self):
+        with self.lock:
+            if self._tree is None:
+                started = time.perf_counter()
+                self._tree = BeautifulSoup(self.decoded, 'html.parser')
+                record_parse("bs4", len(self.raw), time.perf_counter() - started)
+            return self._tree
+
+    def _extract(self):
+        self.ensure_loaded()
+        if html_parser_backend == "bs4":
+            self._text = self.tree.get_text()
+            self._links = [urljoin(self.final_url, link['href']) for link in self.tree.find_all('a', href=True)]
+            return
+        parser = StreamingExtractor(self.final_url)
+        started = time.perf_counter()
+        parser.feed(self.decoded)
+        parser.close()
+        record_parse("stream", len(self.raw), time.perf_counter() - started)
+        self._text = "".join(value for kind, value in parser.events if kind == "text")
+        self._links = [value for kind, value in parser.events if kind == "link"]
+
+    @property
+    def text(self):
+        with self.lock:
+            if self._text is None:
+                self._extract()
+            return self._text
+
+    @property
+    def links(self):
+        with self.lock:
+            if self._links is None:
+                self._extract()
+            return self._links
+
+    def preview(self, limit):
+        """The first limit bytes (all that was fetched when None) as text, with a truncation note when there is more"""
+        self.ensure_loaded()
+        limit = len(self.raw) if limit is None else limit
+        if len(self.raw) <= limit and not self.truncated:
+            return self.decoded
+        text = self.raw[:limit].decode(self.encoding, errors="replace")
+        return truncation_note(text, min(limit, len(self.raw)), self.total_bytes)
+
+
+def get_document(url):
+    """Return the document for url, fetching it only the first time"""
+    with document_lock:
+        document = documents.pop(url, None) or TargetDocument(url)
+        documents[url] = document
+        while len(documents) > document_max_entries:
+            documents.popitem(last=False)
+    return document.ensure_loaded()
+
+
+def loaded_document(url):
+    """The document for url when an earlier command already loaded it"""
+    with document_lock:
+        document = documents.get(url)
+    if document is not None and document.loaded:
+        return document
+    return None
+
+
+def reload_document(url):
+    """Forget the document and its cached response so the next view refetches"""
+    with document_lock:
+        documents.pop(url, None)
+    response_cache.discard(url)
+
+
 def get_frontend_code(url):
     try:
-        response = requests.get(url, timeout=5)
-        return response.text
+        document = loaded_document(url)
+        if document is not None:
+            return document.preview(frontend_max_bytes)
+        # Nothing loaded yet: fetch only the bytes that will be shown
+        return format_preview(url, frontend_max_bytes)
     except requests.exceptions.Timeout:
         log_crash(f"Frontend timeout for {url}")
         return "Error: Connection timeout. Website taking too long to respond."
@@ -279,25 +2949,19 @@ def get_frontend_code(url):
 
 def get_backend_code(url):
     try:
-        result = subprocess.check_output(['curl', '-L', url], timeout=5).decode()
-        if truncate_backend:
-            return result[:1000] + "\n... (truncated)" if len(result) > 1000 else result
-        else:
-            return result
-    except subprocess.TimeoutExpired:
-        log_crash(f"Backend curl timeout for {url}")
+        if not truncate_backend:
+            return get_document(url).preview(None)
+        document = loaded_document(url)
+        if document is not None:
+            return document.preview(backend_preview_bytes)
+        # Nothing loaded yet: a ranged preview avoids downloading a whole bundle for 1 KB of output
+        return format_preview(url, backend_preview_bytes)
+    except requests.exceptions.Timeout:
+        log_crash(f"Backend timeout for {url}")
         return "Error: Request timed out. Backend not responding."
-    except FileNotFoundError:
-        log_crash("Curl not found for backend")
-        try:
-            response = requests.get(url, timeout=5)
-            result = response.text
-            if truncate_backend:
-                return result[:1000] + "\n... (truncated)" if len(result) > 1000 else result
-            else:
-                return result
-        except:
-            return "Error: Cannot retrieve backend code. Tool unavailable."
+    except requests.exceptions.ConnectionError:
+        log_crash(f"Backend connection error for {url}")
+        return "Error: Cannot retrieve backend code. Check URL or internet connection."
     except Exception as e:
         log_crash(f"Backend code error: {str(e)}")
         return "Error: Unable to retrieve backend code. Continuing safely."
@@ -305,72 +2969,361 @@ def get_backend_code(url):
 
 def fetch_text(url):
     try:
-        response = requests.get(url, timeout=5)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        text = soup.get_text()
-        return text
+        return get_document(url).text
     except Exception as e:
         log_crash(f"Fetch text error: {str(e)}")
         return "Error: Unable to fetch text from URL. Continuing safely."
 
 
+# HTTP method probe
+probe_methods = ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS', 'HEAD']
+probe_safe_methods = ['GET', 'HEAD', 'OPTIONS']  # what probe sends unless "probe unsafe" is confirmed
+probe_workers = 16
+probe_host_rate = 10.0  # requests per second per host, 0 for no cap
+last_scan_url = None
+last_scan_pages = []
+
+
+class HostRateLimiter:
+    """Spaces requests to each host at least 1/rate seconds apart"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+    def wait(self, host):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot.get(host, now), now)
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def probe_request(method, url, limiter=None):
+    """Send one method to url and return (url, method, status, elapsed); status is a code or a short error"""
+    if limiter is not None:
+        limiter.wait(urlparse(url).netloc)
+    # Checked right before sending, so a cancelled job sends nothing more (unsafe methods included)
+    check_cancelled()
+    started = time.perf_counter()
+    try:
+        status = http_request(method, url).status_code
+    except requests.exceptions.Timeout:
+        status = "timeout"
+        log_crash(f"Request timeout: {method} {url}", url=url)
+    except requests.exceptions.ConnectionError:
+        status = "conn fail"
+        log_crash(f"Connection error: {method} {url}", url=url)
+    except Exception as e:
+        status = "error"
+        log_crash(f"Request error {method}: {str(e)}", url=url)
+    return url, method, status, time.perf_counter() - started
+
+
+def probe_url(url, methods, limiter=None):
+    """Send methods to url one after another, in order, so a DELETE never overtakes the GET"""
+    return [probe_request(method, url, limiter) for method in methods]
+
+
+def probe_matrix(urls, methods=None, workers=None, rate=None):
+    """Probe many urls concurrently (each url's methods in order), yielding each url's results as it finishes"""
+    methods = probe_safe_methods if methods is None else methods
+    workers = probe_workers if workers is None else workers
+    limiter = HostRateLimiter(probe_host_rate if rate is None else rate)
+    probe_in_context = bind_command_context(probe_url)
+    urls = iter(urls)
+    in_flight = set()
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        while True:
+            check_cancelled()
+            for url in urls:
+                in_flight.add(pool.submit(probe_in_context, url, methods, limiter))
+                if len(in_flight) >= workers * 2:
+                    break
+            if not in_flight:
+                return
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        # On cancel the queued URLs are dropped rather than probed before the pool exits
+        pool.shutdown(cancel_futures=True)
+
+
+def format_probe_cell(status, elapsed):
+    return f"{status} {elapsed * 1000:.0f}ms" if isinstance(status, int) else str(status)
+
+
+def probe_targets(url):
+    """The target plus every page of the last scan, when that scan was of url"""
+    return [url] + [page for page in last_scan_pages if page != url] if last_scan_url == url else [url]
+
+
+def probe_rows(urls, methods=None, workers=None, rate=None, width=12):
+    """Yield the table header, then one row per URL as soon as all of its methods have finished"""
+    methods = probe_safe_methods if methods is None else methods
+    yield "".join(f"{method:<{width}}" for method in methods) + "URL"
+    for results in probe_matrix(urls, methods, workers, rate):
+        yield "".join(f"{format_probe_cell(status, elapsed):<{width}}" for _, _, status, elapsed in results) \
+            + results[0][0]
+
+
+def run_probe(url, args=""):
+    """probe [workers N] [rate N] [unsafe]: method matrix over the pages of the last scan, one row per finished URL
+
+    Only GET, HEAD and OPTIONS are sent unless "unsafe" is given and confirmed.
+    """
+    tokens = args.split()
+    unsafe = "unsafe" in tokens
+    tokens = [token for token in tokens if token != "unsafe"]
+    try:
+        options = dict(zip(tokens[::2], tokens[1::2]))
+        workers = int(options.get("workers", probe_workers))
+        rate = float(options.get("rate", probe_host_rate))
+    except ValueError:
+        typewriter("Error: Use probe [workers N] [rate N] [unsafe].", output)
+        return
+    urls = probe_targets(url)
+    methods = probe_safe_methods
+    if unsafe:
+        answer = ui_call_sync(simpledialog.askstring, "Unsafe probe",
+                              f"Send POST, PUT and DELETE to {len(urls)} page(s)? Type yes to continue:")
+        if (answer or "").strip().lower() != "yes":
+            typewriter("Unsafe probe cancelled.", output)
+            return
+        methods = probe_methods
+    typewriter(f"Probing {len(urls)} page(s) x {len(methods)} methods "
+               f"({workers} workers, {rate or 'no'} req/s per host cap)...", output)
+    started = time.perf_counter()
+    for row in probe_rows(urls, methods, workers, rate):
+        render_text(row, output)
+    typewriter(f"Probed {len(urls) * len(methods)} requests in {time.perf_counter() - started:.2f}s", output)
+
+
+def run_export(url, path=""):
+    """export [FILE]: crawl url again, streaming every page to FILE (.jsonl, or .csv by extension)"""
+    path = path or default_export_path(url)
+    typewriter(f"Exporting scan of {url} to {path}...", output)
+    ui_post(progress_bar.start)
+    try:
+        result, rows = export_scan(url, path)
+    except OSError as e:
+        log_crash(f"Export file error: {str(e)}", url=url)
+        typewriter(f"Error: Unable to write {path}. Continuing safely.", output)
+        return
+    finally:
+        ui_post(progress_bar.stop)
+    if result["error"]:
+        typewriter(result["error"], output)
+    typewriter(f"{rows} rows written to {os.path.abspath(path)}", output)
+
+
 def send_requests(url):
-    methods = ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS', 'HEAD']
     responses = []
-    for method in methods:
-        try:
-            response = requests.request(method, url, timeout=5)
-            responses.append(f"{method} {url} - Status: {response.status_code}")
-        except requests.exceptions.Timeout:
+    for _, method, status, elapsed in probe_url(url, probe_methods):
+        if isinstance(status, int):
+            responses.append(f"{method} {url} - Status: {status}")
+        elif status == "timeout":
             responses.append(f"{method} {url} - Timeout (skipped)")
-            log_crash(f"Request timeout: {method} {url}")
-        except requests.exceptions.ConnectionError:
+        elif status == "conn fail":
             responses.append(f"{method} {url} - Connection failed (skipped)")
-            log_crash(f"Connection error: {method} {url}")
-        except Exception as e:
+        else:
             responses.append(f"{method} {url} - Error handled (continuing)")
-            log_crash(f"Request error {method}: {str(e)}")
     return "\n".join(responses)
 
 
-def download_update():
-    url = simpledialog.askstring("Update", "Enter update link:")
-    if url:
-        progress_window = tk.Toplevel(root)
-        progress_window.title("Updating...")
-        progress_label = tk.Label(progress_window, text="Downloading Update...", fg="green")
-        progress_label.pack()
-        progress = ttk.Progressbar(progress_window, mode="determinate", length=300)
-        progress.pack()
-        progress.start()
+# Update downloader
+update_target = "Nextdomain_Scanner.py"
+update_chunk_size = 64 * 1024
+
+
+class ChecksumMismatch(Exception):
+    pass
+
+
+class DownloadIncomplete(Exception):
+    pass
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def published_sha256(url):
+    """SHA-256 published next to url as url.sha256 (sha256sum format), or None"""
+    try:
+        response = http_request("GET", url + ".sha256")
+        if response.status_code == 200:
+            token = response.text.split()[0].lower() if response.text.split() else ""
+            if len(token) == 64 and all(c in "0123456789abcdef" for c in token):
+                return token
+    except requests.exceptions.RequestException:
+        pass
+    return None
+
+
+def download_file(url, target, expected_sha256=None, on_progress=None):
+    """Stream url into target.part, resuming a previous partial download, then verify and rename into place.
+
+    The partial file and its validators (target.part.json) are kept when the
+    download is interrupted, so the next call continues with a Range
+    request. on_progress(done, total) is called per chunk; total is None
+    when the server sends no length. Returns the SHA-256 of the file.
+    """
+    partial = target + ".part"
+    meta_path = partial + ".json"
+    meta = {}
+    if os.path.exists(partial) and os.path.exists(meta_path):
         try:
-            urllib.request.urlretrieve(url, "Nextdomain_Scanner.py")
-            progress.stop()
-            progress_label.config(text="Update Completed. Restarting application...")
-            progress_window.update()
-            time.sleep(1)
-            progress_window.destroy()
-            try:
-                with open("version_info.txt", "w") as f:
-                    f.write(f"Dropbox Version: {url}")
-            except Exception as e:
-                log_crash(f"Version save error: {str(e)}")
-            root.destroy()
-            try:
-                subprocess.Popen(['python3', 'Nextdomain_Scanner.py'])
-            except FileNotFoundError:
-                try:
-                    subprocess.Popen(['python', 'Nextdomain_Scanner.py'])
-                except:
-                    log_crash("Cannot restart application automatically")
-        except urllib.error.URLError:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+    validator = meta.get("etag") or meta.get("last_modified")
+    # Without a validator a changed file could not be detected, so the download starts over
+    offset = os.path.getsize(partial) if meta.get("url") == url and validator and os.path.exists(partial) else 0
+    headers = {"Accept-Encoding": "identity"}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        # Resume only if the file is unchanged; otherwise the server sends it whole
+        headers["If-Range"] = validator
+    response = http_request("GET", url, headers=headers, stream=True)
+    try:
+        if response.status_code == 416 and offset and offset == meta.get("total"):
+            response.close()
+        else:
+            response.raise_for_status()
+            if response.status_code == 206:
+                start = response.headers.get("Content-Range", "").replace("bytes ", "").partition("-")[0].strip()
+                if start != str(offset):
+                    # The server resumed somewhere else; the partial file cannot be trusted
+                    log_crash(f"Update resumed at byte {start or '?'} instead of {offset}, restarting", url=url)
+                    response.close()
+                    os.remove(partial)
+                    os.remove(meta_path)
+                    return download_file(url, target, expected_sha256, on_progress)
+            else:
+                offset = 0
+            length = response.headers.get("Content-Length", "")
+            total = offset + int(length) if length.isdigit() else None
+            meta = {"url": url, "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"), "total": total}
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            done = offset
+            with open(partial, "ab" if offset else "wb") as f:
+                for chunk in response.iter_content(update_chunk_size):
+                    f.write(chunk)
+                    done += len(chunk)
+                    metrics.add_bytes(len(chunk))
+                    if on_progress is not None:
+                        on_progress(done, total)
+                f.flush()
+                os.fsync(f.fileno())
+            if total is not None and done != total:
+                raise DownloadIncomplete(f"Download incomplete: {done} of {total} bytes")
+    except DownloadIncomplete:
+        raise
+    except requests.exceptions.ChunkedEncodingError as e:
+        # The connection dropped mid-body; what was written so far is kept for the resume
+        raise DownloadIncomplete(f"Connection lost mid-download: {str(e)}")
+    finally:
+        response.close()
+    sha256 = file_sha256(partial)
+    if expected_sha256 and sha256 != expected_sha256.lower():
+        os.remove(partial)
+        os.remove(meta_path)
+        raise ChecksumMismatch(f"expected {expected_sha256}, got {sha256}")
+    os.replace(partial, target)
+    os.remove(meta_path)
+    return sha256
+
+
+def download_update():
+    answer = simpledialog.askstring("Update", "Enter update link (optionally followed by its SHA-256):")
+    if not answer or not answer.split():
+        return
+    url, *rest = answer.split()
+    expected = rest[0] if rest else None
+    progress_window = tk.Toplevel(root)
+    progress_window.title("Updating...")
+    progress_label = tk.Label(progress_window, text="Downloading Update...", fg="green")
+    progress_label.pack()
+    progress = ttk.Progressbar(progress_window, mode="determinate", length=300, maximum=100)
+    progress.pack()
+    last_shown = [0.0]
+
+    def show_progress(done, total):
+        if total:
             progress.stop()
-            progress_label.config(text="Error: Invalid URL or connection failed")
+            progress.config(mode="determinate", value=done * 100 / total)
+            progress_label.config(text=f"Downloading Update... {done / 1048576:.1f} of {total / 1048576:.1f} MB")
+        else:
+            progress.config(mode="indeterminate")
+            progress.start()
+            progress_label.config(text=f"Downloading Update... {done / 1048576:.1f} MB")
+
+    def on_progress(done, total):
+        # A few UI updates per second are enough; every chunk would flood the UI queue
+        now = time.monotonic()
+        if now - last_shown[0] >= 0.1 or done == total:
+            last_shown[0] = now
+            ui_post(show_progress, done, total)
+
+    def failed(text):
+        progress.stop()
+        progress_label.config(text=text)
+
+    def finish(sha256, verified):
+        progress.stop()
+        progress.config(mode="determinate", value=100)
+        note = "checksum verified" if verified else "no checksum published, size verified"
+        progress_label.config(text=f"Update Completed ({note}). Restarting application...")
+        root.after(1000, restart_after_update, url, sha256)
+
+    def run():
+        try:
+            checksum = expected or published_sha256(url)
+            sha256 = download_file(url, update_target, checksum, on_progress)
+            ui_post(finish, sha256, bool(checksum))
+        except ChecksumMismatch as e:
+            ui_post(failed, "Error: Checksum mismatch, update discarded.")
+            log_crash(f"Update checksum mismatch for {url}: {str(e)}")
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, DownloadIncomplete) as e:
+            ui_post(failed, "Error: Connection lost. Run update with the same link to resume.")
+            log_crash(f"Update interrupted for {url}: {str(e)}")
+        except requests.exceptions.RequestException:
+            ui_post(failed, "Error: Invalid URL or connection failed")
             log_crash(f"Update URL error: {url}")
         except Exception as e:
-            progress_label.config(text=f"Error: Update failed. Continuing safely.")
-            progress.stop()
+            ui_post(failed, "Error: Update failed. Continuing safely.")
             log_crash(f"Update error: {str(e)}")
+    start_worker(bind_command_context(run))
+
+
+def restart_after_update(url, sha256):
+    try:
+        with open("version_info.txt", "w") as f:
+            f.write(f"Dropbox Version: {url}\nSHA-256: {sha256}")
+    except Exception as e:
+        log_crash(f"Version save error: {str(e)}")
+    root.destroy()
+    try:
+        subprocess.Popen(['python3', update_target])
+    except FileNotFoundError:
+        try:
+            subprocess.Popen(['python', update_target])
+        except:
+            log_crash("Cannot restart application automatically")
 
 
 def display_help():
@@ -385,17 +3338,26 @@ def display_help():
     help - Show this menu
     chatpost - Open chat interface to POST messages
     runfile - Run a Python file by specifying path
-    logconsole - Open realtime log console window
+    logconsole - Open live metrics console window
+    metricsdump - Save a metrics snapshot (optionally: metricsdump PATH)
+    timings - Show wall/network/parse/render time of recent commands
+    profile N - Profile the next N commands, one at a time, command thread only (default 1)
     exitconsole - Close log console window
     rethack - Show matrix animation text
     crashlog - View crash and bug log
-    activitylog - View all previously searched domains
+    activitylog - View scan history (last N, page N, domain NAME, since/until YYYY-MM-DD, scan ID)
     addshortcut - Create desktop shortcut (Windows only)
-    runbackground - Run scans in background
+    runbackground - Run a job in the background (or: runbackground SUBCOMMAND [URL])
+    jobs - List background jobs
+    job ID - Show the result of a background job
+    cancel ID - Cancel a queued or running background job
     settings - Open settings window
     clear - Clear output
     clearlog - Clear all logs and start fresh
     fetchtext - Fetch and display text from URL
+    probe - GET/HEAD/OPTIONS matrix over the scanned pages (optionally: probe workers N rate N unsafe)
+    reload - Drop the fetched page so the next view downloads it again
+    export - Crawl again, streaming every page to a JSONL/CSV file (optionally: export FILE)
     exit - Exit the program"""
 
 
@@ -403,6 +3365,7 @@ def display_help():
 log_console = None
 log_console_text = None
 log_console_running = False
+log_console_refresh_ms = 1000
 
 
 def open_log_console():
@@ -415,30 +3378,39 @@ def open_log_console():
         log_console.title("Log Console nxtinstant")
         log_console.geometry("700x400")
         log_console.configure(bg="black")
-        log_console_text = tk.Text(log_console, bg="black", fg="lime", font=("Courier", 12), state=tk.DISABLED, wrap=tk.WORD)
+        log_console.protocol("WM_DELETE_WINDOW", close_log_console)
+        tk.Button(log_console, text="Export Snapshot", bg="#0f5132", fg="white", font=("Courier", 10, "bold"),
+                  command=export_metrics_from_console).pack(anchor=tk.E, padx=5, pady=(5, 0))
+        log_console_text = tk.Text(log_console, bg="black", fg="lime", font=("Courier", 12), state=tk.DISABLED, wrap=tk.NONE)
         log_console_text.pack(expand=True, fill=tk.BOTH, padx=5, pady=5)
-        def log_writer():
-            count = 0
-            while log_console_running:
-                try:
-                    time.sleep(1)
-                    if log_console_text and log_console_text.winfo_exists():
-                        log_console_text.config(state=tk.NORMAL)
-                        log_console_text.insert(tk.END, f"NEXTDOMAIN running perfectly... {count}\n")
-                        log_console_text.see(tk.END)
-                        log_console_text.config(state=tk.DISABLED)
-                        count += 1
-                    else:
-                        break
-                except Exception as e:
-                    log_crash(f"Log writer error: {str(e)}")
-                    break
-        threading.Thread(target=log_writer, daemon=True).start()
+        refresh_log_console()
     except Exception as e:
         log_crash(f"Open log console error: {str(e)}")
         log_console_running = False
 
 
+def refresh_log_console():
+    """Redraw the metrics view once a second on the main loop while the console is open"""
+    if not log_console_running or log_console_text is None or not log_console_text.winfo_exists():
+        return
+    try:
+        log_console_text.config(state=tk.NORMAL)
+        log_console_text.delete(1.0, tk.END)
+        log_console_text.insert(tk.END, metrics.render())
+        log_console_text.config(state=tk.DISABLED)
+    except Exception as e:
+        log_crash(f"Log console refresh error: {str(e)}")
+    root.after(log_console_refresh_ms, refresh_log_console)
+
+
+def export_metrics_from_console():
+    try:
+        typewriter(f"Metrics snapshot saved to {export_metrics()}", output)
+    except Exception as e:
+        log_crash(f"Metrics export error: {str(e)}")
+        typewriter("Error: Unable to save metrics snapshot.", output)
+
+
 def close_log_console():
     global log_console_running, log_console
     try:
@@ -453,19 +3425,77 @@ def close_log_console():
 
 
 def type_matrix_text(text_widget, text, delay=0.05):
-    try:
-        text_widget.delete(1.0, tk.END)
-        for char in text:
-            text_widget.insert(tk.END, char)
-            text_widget.update()
-            time.sleep(delay)
-    except Exception as e:
-        log_crash(f"Matrix text error: {str(e)}")
+    ui_post(text_widget.delete, 1.0, tk.END)
+    typewriter(text, text_widget, delay=delay, end="")
+
+
+# Chat POST sender
+chat_queue_size = 256
+
+
+class ChatSender:
+    """Sends chat messages to one URL from a single worker over the pooled keep-alive session.
+
+    Messages are numbered and queued (at most chat_queue_size waiting); the
+    one worker sends them in order, so on_reply(number, reply, latency,
+    queued) is called in the order the messages were typed.
+    """
+
+    def __init__(self, target_url, on_reply, max_pending=None):
+        self.target_url = target_url
+        self.on_reply = on_reply
+        self.outbound = queue.Queue(maxsize=chat_queue_size if max_pending is None else max_pending)
+        self.next_number = 1
+        self.closed = threading.Event()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def send(self, message):
+        """Queue message and return its number, or None when the queue is full or the sender closed"""
+        if self.closed.is_set():
+            return None
         try:
-            text_widget.insert(tk.END, text)
-        except:
+            self.outbound.put_nowait((self.next_number, message, time.perf_counter()))
+        except queue.Full:
+            return None
+        self.next_number += 1
+        return self.next_number - 1
+
+    def close(self):
+        """Drop messages not yet sent and stop the worker after the one in progress"""
+        self.closed.set()
+        while True:
+            try:
+                self.outbound.get_nowait()
+            except queue.Empty:
+                break
+        try:
+            self.outbound.put_nowait(None)
+        except queue.Full:
+            # Only if send() raced the drain; the worker still sees closed on its next message
             pass
 
+    def run(self):
+        while True:
+            item = self.outbound.get()
+            if item is None or self.closed.is_set():
+                return
+            number, message, queued_at = item
+            started = time.perf_counter()
+            try:
+                response = http_request("POST", self.target_url, data={"message": message})
+                reply = f"Server: {response.text.strip()}"
+            except requests.exceptions.Timeout:
+                reply = "Error: Server timeout (continuing safely)"
+                log_crash(f"Chat POST timeout to {self.target_url}")
+            except requests.exceptions.ConnectionError:
+                reply = "Error: Cannot connect to server"
+                log_crash(f"Chat POST connection error to {self.target_url}")
+            except Exception as e:
+                reply = "Error: Request failed (continuing safely)"
+                log_crash(f"Chat POST error: {str(e)}")
+            self.on_reply(number, reply, time.perf_counter() - started, started - queued_at)
+
 
 def open_chat_post():
     target_url = simpledialog.askstring("ChatPost", "Enter URL to send POST requests to:")
@@ -480,46 +3510,45 @@ def open_chat_post():
         chat_display.pack(expand=True, fill=tk.BOTH, padx=5, pady=5)
         msg_entry = tk.Entry(chat_win, bg="black", fg="lime", font=("Courier", 12), insertbackground="lime")
         msg_entry.pack(fill=tk.X, padx=5, pady=5)
-        def post_message(event=None):
-            message = msg_entry.get().strip()
-            if not message:
-                return
-            msg_entry.delete(0, tk.END)
+
+        def show_line(line):
             try:
                 chat_display.config(state=tk.NORMAL)
-                chat_display.insert(tk.END, f"You: {message}\n")
+                chat_display.insert(tk.END, line + "\n")
                 chat_display.config(state=tk.DISABLED)
                 chat_display.see(tk.END)
             except Exception as e:
                 log_crash(f"Chat display error: {str(e)}")
-            def send():
-                try:
-                    response = requests.post(target_url, data={"message": message}, timeout=5)
-                    reply = f"Server: {response.text.strip()}"
-                except requests.exceptions.Timeout:
-                    reply = "Error: Server timeout (continuing safely)"
-                    log_crash(f"Chat POST timeout to {target_url}")
-                except requests.exceptions.ConnectionError:
-                    reply = "Error: Cannot connect to server"
-                    log_crash(f"Chat POST connection error to {target_url}")
-                except Exception as e:
-                    reply = f"Error: Request failed (continuing safely)"
-                    log_crash(f"Chat POST error: {str(e)}")
-                try:
-                    chat_display.config(state=tk.NORMAL)
-                    chat_display.insert(tk.END, reply + "\n")
-                    chat_display.config(state=tk.DISABLED)
-                    chat_display.see(tk.END)
-                except Exception as e:
-                    log_crash(f"Chat reply display error: {str(e)}")
-            threading.Thread(target=send).start()
+
+        def on_reply(number, reply, latency, queued):
+            wait_note = f", queued {queued * 1000:.0f} ms" if queued >= 0.001 else ""
+            ui_post(show_line, f"[#{number} {latency * 1000:.1f} ms{wait_note}] {reply}")
+
+        sender = ChatSender(target_url, on_reply)
+
+        def post_message(event=None):
+            message = msg_entry.get().strip()
+            if not message:
+                return
+            number = sender.send(message)
+            if number is None:
+                # Keep the text so it can be sent again once replies catch up
+                show_line(f"(queue full: {sender.outbound.qsize()} messages waiting, try again shortly)")
+                return
+            msg_entry.delete(0, tk.END)
+            show_line(f"You [#{number}]: {message}")
+
+        def close_chat():
+            sender.close()
+            chat_win.destroy()
         msg_entry.bind("<Return>", post_message)
+        chat_win.protocol("WM_DELETE_WINDOW", close_chat)
     except Exception as e:
         log_crash(f"Open chat post error: {str(e)}")
 
 
 def run_file():
-    filepath = simpledialog.askstring("Run File", "Enter full file path to run:")
+    filepath = ui_call_sync(simpledialog.askstring, "Run File", "Enter full file path to run:")
     if not filepath:
         return "No file path provided."
     try:
@@ -576,28 +3605,72 @@ def copy_code():
         typewriter("Error: Unable to copy code. Continuing safely.", output)
 
 
-def process_initial_input():
+def set_prompt(text, on_enter):
+    """Reset the entry to text and run on_enter(entry value) on a worker thread when Enter is hit"""
+    def apply():
+        entry.delete(0, tk.END)
+        entry.insert(0, text)
+        entry.bind("<Return>", lambda e: start_worker(on_enter, entry.get()))
+    ui_post(apply)
+
+
+def process_initial_input(cmd):
+    cmd = cmd.strip()
+    run_command("scan", cmd, scan_target, cmd)
+
+
+def format_scan_listing(result):
+    listing = ["Pages Found:"] + [f" - {p}" for p in result["pages"]]
+    listing += ["\nHidden Pages:"] + [f" - {h}" for h in result["hidden_pages"]]
+    diff = result.get("diff")
+    if diff is not None:
+        listing.append(f"\nSince last scan: {len(diff['new'])} new, {len(diff['removed'])} removed, "
+                       f"{len(diff['changed'])} changed, {diff['unchanged']} unchanged")
+        for label in ("new", "removed", "changed"):
+            listing += [f" {label}: {page}" for page in diff[label]]
+    return "\n".join(listing)
+
+
+def scan_many(urls):
+    """Scan several domains at once (sharded across processes when batch_processes > 1), one line per result"""
+    typewriter(f"Scanning {len(urls)} domains...", output)
+    ui_post(progress_bar.start)
+    try:
+        if batch_processes > 1:
+            results = scan_domains_sharded(urls)
+        else:
+            results = scan_domains(urls, max_depth=crawl_max_depth)
+        for result in results:
+            record_scan(result)
+            summary = result["error"] or (f"{len(result['pages'])} pages, {len(result['hidden_pages'])} hidden, "
+                                          f"status {result['status_code']}")
+            render_text(f"{result['url']}: {summary} ({result['elapsed'] or 0:.2f}s)", output)
+    finally:
+        ui_post(progress_bar.stop)
+    typewriter("Done. Use activitylog to see the pages of each scan.", output)
+
+
+def scan_target(cmd):
+    global last_scan_url, last_scan_pages
     try:
-        cmd = entry.get().strip()
-        output.delete(1.0, tk.END)
-        progress_bar.start()
-        time.sleep(2)
-        progress_bar.stop()
-        if is_valid_url(cmd):
-            pages, hidden = scan_website(cmd, progress_bar)
-            if "Error" in str(hidden):
-                typewriter(str(hidden.pop()) if hidden else "Error scanning website", output)
+        clear_output()
+        targets = cmd.split()
+        if len(targets) > 1 and all(is_valid_url(target) for target in targets):
+            scan_many(targets)
+        elif is_valid_url(cmd):
+            ui_post(progress_bar.start)
+            try:
+                result = scan_domain(cmd)
+            finally:
+                ui_post(progress_bar.stop)
+            record_scan(result)
+            last_scan_url = cmd
+            last_scan_pages = result["pages"] + result["hidden_pages"]
+            if result["error"]:
+                typewriter(result["error"], output)
             else:
-                typewriter("Pages Found:", output)
-                for p in pages:
-                    typewriter(f" - {p}", output)
-                typewriter("\nHidden Pages:", output)
-                for h in hidden:
-                    typewriter(f" - {h}", output)
-                entry.delete(0, tk.END)
-                entry.insert(0, f"{cmd}> ")
-                entry.bind("<Return>", lambda e: threading.Thread(target=lambda: process_command(cmd)).start())
-                log_domain(cmd)
+                render_text(format_scan_listing(result), output)
+                set_prompt(f"{cmd}> ", lambda line: process_command(cmd, line))
         else:
             typewriter("Error: Please enter a valid domain (e.g., https://nxtinstant.in)", output)
     except Exception as e:
@@ -606,29 +3679,171 @@ def process_initial_input():
         setup_initial_screen()
 
 
-def run_background_task(url, subcommand, btn_frame):
-    if subcommand == "codewebfront":
-        result = get_frontend_code(url)
-    elif subcommand == "codewebback":
-        result = get_backend_code(url)
+# Background jobs
+job_workers = 4
+job_history = 50
+
+
+def scan_job(url):
+    result = scan_domain(url)
+    record_scan(result)
+    return result["error"] or format_scan_listing(result)
+
+
+def probe_job(url):
+    return "\n".join(probe_rows(probe_targets(url)))
+
+
+def export_job(url):
+    path = default_export_path(url)
+    result, rows = export_scan(url, path)
+    return (result["error"] + "\n" if result["error"] else "") + f"{rows} rows written to {os.path.abspath(path)}"
+
+
+JOB_TASKS = {
+    "codewebfront": get_frontend_code,
+    "codewebback": get_backend_code,
+    "fetchtext": fetch_text,
+    "headers": analyze_stream,
+    "scan": scan_job,
+    "probe": probe_job,
+    "export": export_job,
+}
+
+
+class Job:
+    def __init__(self, job_id, url, subcommand):
+        self.id = job_id
+        self.url = url
+        self.subcommand = subcommand
+        self.state = "queued"
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.cancel_event = CancelToken()
+        self.future = None
+
+    def describe(self):
+        if self.finished is not None:
+            took = f"{self.finished - (self.started or self.finished):.2f}s"
+        elif self.started is not None:
+            took = f"{time.time() - self.started:.1f}s so far"
+        else:
+            took = "waiting"
+        return f"#{self.id:<4} {self.state:<10} {self.subcommand:<13} {took:<14} {self.url}"
+
+
+class JobScheduler:
+    """Runs background jobs on a bounded pool; finished jobs are kept for result retrieval"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.pool = None
+        self.jobs = OrderedDict()
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+    def submit(self, url, subcommand):
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+            job = Job(self.next_id, url, subcommand)
+            self.next_id += 1
+            self.jobs[job.id] = job
+            job.future = self.pool.submit(self._run, job)
+            self._trim()
+        return job
+
+    def _run(self, job):
+        with self.lock:
+            if job.state != "queued":
+                return
+            job.state = "running"
+            job.started = time.time()
+        command_context.cancel = job.cancel_event
+        try:
+            job.result = run_command(f"job {job.subcommand}", job.url, JOB_TASKS[job.subcommand], job.url)
+            job.state = "done"
+        except JobCancelled:
+            job.state = "cancelled"
+        except Exception as e:
+            log_crash(f"Background job #{job.id} error: {str(e)}", url=job.url)
+            job.error = str(e)
+            job.state = "failed"
+        finally:
+            command_context.cancel = None
+            job.finished = time.time()
+        hint = f" - type 'job {job.id}' to show the result" if job.state in ("done", "failed") else ""
+        typewriter(f"[job #{job.id}] {job.subcommand} {job.state}{hint}", output)
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return "No job with that id."
+            if job.state == "queued":
+                job.future.cancel()
+                job.state = "cancelled"
+                job.finished = time.time()
+                return f"Job #{job_id} cancelled."
+            if job.state == "running":
+                job.cancel_event.set()
+                return f"Job #{job_id} will stop at its next checkpoint."
+            return f"Job #{job_id} already {job.state}."
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def listing(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        if not jobs:
+            return "No background jobs."
+        return "\n".join(["=== Background Jobs ==="] + [job.describe() for job in jobs])
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished is not None]
+        for job_id in finished[:max(len(finished) - job_history, 0)]:
+            del self.jobs[job_id]
+
+
+job_scheduler = JobScheduler(job_workers)
+
+
+def submit_background_job(url, subcommand):
+    if subcommand not in JOB_TASKS:
+        typewriter(f"Invalid subcommand. Choose one of: {', '.join(JOB_TASKS)}", output)
+        return None
+    job = job_scheduler.submit(url, subcommand)
+    typewriter(f"Job #{job.id} queued: {subcommand} {url}", output)
+    return job
+
+
+def show_job(args):
+    job = job_scheduler.get(int(args)) if args.isdigit() else None
+    if job is None:
+        typewriter("No job with that id. Use 'jobs' to list them.", output)
+    elif job.state == "done":
+        render_text(job.result if isinstance(job.result, str) else str(job.result), output)
+    elif job.state == "failed":
+        typewriter(f"Job #{job.id} failed: {job.error}", output)
     else:
-        typewriter("Invalid subcommand.", output)
-        btn_frame.pack_forget()
-        return
-    typewriter(result, output)
-    typewriter("done", output)
-    btn_frame.pack_forget()
+        typewriter(f"Job #{job.id} is {job.state}.", output)
 
 
 def runbackground_command(url):
-    output.delete(1.0, tk.END)
-    typewriter("Run background subcommand:\n1: codewebfront\n2: codewebback", output)
+    clear_output()
+    typewriter("Run background subcommand (or type: runbackground SUBCOMMAND [URL]):\n"
+               + "\n".join(f"{number}: {name}" for number, name in enumerate(JOB_TASKS, 1)), output)
     btn_frame = tk.Frame(root, bg="black")
     btn_frame.pack(pady=5)
-    btn1 = tk.Button(btn_frame, text="1", command=lambda: run_background_task(url, "codewebfront", btn_frame), width=5)
-    btn1.pack(side=tk.LEFT, padx=10)
-    btn2 = tk.Button(btn_frame, text="2", command=lambda: run_background_task(url, "codewebback", btn_frame), width=5)
-    btn2.pack(side=tk.RIGHT, padx=10)
+    for number, name in enumerate(JOB_TASKS, 1):
+        button = tk.Button(btn_frame, text=str(number), width=5,
+                           command=lambda name=name: (btn_frame.pack_forget(), submit_background_job(url, name)))
+        button.pack(side=tk.LEFT, padx=10)
 
 
 def open_settings():
@@ -643,85 +3858,121 @@ def open_settings():
               command=set_dark_theme).pack(pady=5)
     tk.Button(settings_win, text="Toggle Truncate Backend Code", bg="#0f5132", fg="white", font=("Courier", 10, "bold"),
               command=toggle_truncation).pack(pady=5)
+    tk.Button(settings_win, text="Toggle Typewriter Effect", bg="#0f5132", fg="white", font=("Courier", 10, "bold"),
+              command=toggle_typewriter).pack(pady=5)
 
 
 def clear_output():
-    output.delete(1.0, tk.END)
+    ui_post(output.delete, 1.0, tk.END)
 
 
 def clear_logs():
-    log_path = os.path.expanduser("~/activity.log")
-    if os.path.exists(log_path):
-        os.remove(log_path)
-    if os.path.exists("crash_log.txt"):
-        os.remove("crash_log.txt")
-    global crash_log
-    crash_log = []
+    if os.path.exists(legacy_activity_log):
+        os.remove(legacy_activity_log)
+    try:
+        clear_history()
+    except Exception as e:
+        log_crash(f"History clear error: {str(e)}")
+    clear_crash_log()
     typewriter("All logs cleared. Starting a fresh journey!", output)
 
 
-def process_command(url):
-    global copy_button
+def process_command(url, line):
+    cmd = line.replace(f"{url}> ", "").strip()
+    run_command(cmd, url, dispatch_command, url, cmd)
+
+
+def dispatch_command(url, cmd):
+    global profile_remaining
     try:
-        cmd = entry.get().replace(f"{url}> ", "").strip()
-        output.delete(1.0, tk.END)
-        setup_copy_button()
+        clear_output()
+        ui_post(setup_copy_button)
         if cmd == "analyze stream":
-            typewriter(analyze_stream(url), output)
+            render_text(analyze_stream(url), output)
         elif cmd == "codewebfront":
-            typewriter(get_frontend_code(url), output)
-            add_copy_button()
+            render_text(get_frontend_code(url), output)
+            ui_post(add_copy_button)
         elif cmd == "codewebback":
-            typewriter(get_backend_code(url), output)
-            add_copy_button()
+            render_text(get_backend_code(url), output)
+            ui_post(add_copy_button)
         elif cmd == "deldo":
             setup_initial_screen()
             return
         elif cmd == "pause":
             typewriter("Output paused. Hit Enter to continue.", output)
-            entry.wait_variable(tk.StringVar())
+            resume = threading.Event()
+            set_prompt(f"{url}> ", lambda value: resume.set())
+            resume.wait()
         elif cmd == "about":
             typewriter("nextdomain v3.1211 - Created by Aryan Wankhede", output)
             typewriter("Website: web.nxtinstant.in", output)
         elif cmd == "update":
-            download_update()
+            ui_post(download_update)
         elif cmd == "help":
-            typewriter(display_help(), output)
+            render_text(display_help(), output)
         elif cmd == "secret1211":
-            password = simpledialog.askstring("verify that you are Aryan", "Enter password:", show='A')
+            password = ui_call_sync(simpledialog.askstring, "verify that you are Aryan", "Enter password:", show='A')
             if password == "1211":
                 typewriter("Welcome, Aryan! Sending all possible requests...", output)
-                typewriter(send_requests(url), output)
+                render_text(send_requests(url), output)
             else:
                 typewriter("Incorrect password!", output)
         elif cmd == "chatpost":
-            open_chat_post()
+            ui_post(open_chat_post)
         elif cmd == "runfile":
             output_text = run_file()
-            typewriter(output_text, output)
+            render_text(output_text, output)
         elif cmd == "logconsole":
-            open_log_console()
+            ui_post(open_log_console)
         elif cmd == "exitconsole":
-            close_log_console()
+            ui_post(close_log_console)
+        elif cmd == "timings":
+            render_text(format_timings(), output)
+        elif cmd == "profile" or cmd.startswith("profile "):
+            count = cmd[len("profile"):].strip()
+            with timing_lock:
+                profile_remaining = int(count) if count.isdigit() else 1
+            typewriter(f"Profiling the next {profile_remaining} command(s) on their own thread "
+                       f"(worker pools show as waits); stats go to {profile_dir}/", output)
+        elif cmd == "metricsdump" or cmd.startswith("metricsdump "):
+            path = export_metrics(cmd[len("metricsdump"):].strip() or None)
+            typewriter(f"Metrics snapshot saved to {path}", output)
         elif cmd == "crashlog":
             if crash_log:
                 typewriter("=== Crash & Bug Log ===", output)
-                for log_entry in crash_log[-10:]:
-                    typewriter(f"[{log_entry['time']}] {log_entry['error']}", output)
-                typewriter(f"\nTotal crashes handled: {len(crash_log)}", output)
+                recent = list(crash_log)[-10:]
+                render_text("\n".join(format_crash(log_entry) for log_entry in recent), output)
+                typewriter(f"\nTotal crashes handled: {crash_count}", output)
             else:
                 typewriter("No crashes detected. System running smoothly!", output)
+            typewriter(response_cache.summary(), output)
+            typewriter(parse_summary(), output)
+            typewriter(dns_cache.summary(), output)
         elif cmd == "rethack":
             matrix_text = ("developers are the best")
             type_matrix_text(output, matrix_text)
-        elif cmd == "activitylog":
-            show_activity_log()
+        elif cmd == "activitylog" or cmd.startswith("activitylog "):
+            show_activity_log(cmd[len("activitylog"):])
         elif cmd == "addshortcut":
             create_shortcut()
         elif cmd == "runbackground":
-            runbackground_command(url)
+            ui_post(runbackground_command, url)
+        elif cmd.startswith("runbackground "):
+            args = cmd.split()
+            job_url = args[2] if len(args) > 2 else url
+            if is_valid_url(job_url):
+                submit_background_job(job_url, args[1])
+            else:
+                typewriter("Error: Please enter a valid domain (e.g., https://nxtinstant.in)", output)
+        elif cmd == "jobs":
+            render_text(job_scheduler.listing(), output)
+        elif cmd.startswith("job "):
+            show_job(cmd[len("job "):].strip())
+        elif cmd.startswith("cancel "):
+            job_id = cmd[len("cancel "):].strip()
+            typewriter(job_scheduler.cancel(int(job_id)) if job_id.isdigit() else "Use: cancel JOB_ID", output)
         elif cmd == "settings":
-            open_settings()
+            ui_post(open_settings)
         elif cmd == "clear":
             clear_output()
         elif cmd == "clearlog":
@@ -729,28 +3980,30 @@ def process_command(url):
         elif cmd == "fetchtext":
             typewriter("Fetching text from URL...", output)
             text = fetch_text(url)
-            typewriter(text, output)
+            render_text(text, output)
+        elif cmd == "probe" or cmd.startswith("probe "):
+            run_probe(url, cmd[len("probe"):])
+        elif cmd == "export" or cmd.startswith("export "):
+            run_export(url, cmd[len("export"):].strip())
+        elif cmd == "reload":
+            reload_document(url)
+            typewriter("Page will be fetched again on the next view.", output)
         elif cmd == "exit":
             typewriter("exiting server nxtinstant closed...", output)
-            root.quit()
+            ui_post(root.quit)
         else:
             typewriter("Error: Invalid command. Type 'help' for options.", output)
-        entry.delete(0, tk.END)
-        entry.insert(0, f"{url}> ")
+        set_prompt(f"{url}> ", lambda value: process_command(url, value))
     except Exception as e:
         log_crash(f"Process command error: {str(e)}")
         typewriter("Error processing command. System continuing safely.", output)
-        try:
-            entry.delete(0, tk.END)
-            entry.insert(0, f"{url}> ")
-        except:
-            pass
+        set_prompt(f"{url}> ", lambda value: process_command(url, value))
 
 
 def setup_initial_screen():
     try:
-        output.delete(1.0, tk.END)
-        load_theme()
+        clear_output()
+        ui_post(load_theme)
         version_text = "Nextdomain v3.1211 - Matrix Style Scanner"
         try:
             with open("version_info.txt", "r") as f:
@@ -762,27 +4015,14 @@ def setup_initial_screen():
             log_crash(f"Version info read error: {str(e)}")
         typewriter(version_text, output)
         typewriter(">" * 25, output)
-        entry.delete(0, tk.END)
-        entry.insert(0, "https://")
-        entry.config(state=tk.NORMAL)
-        entry.focus_set()
-        entry.bind("<Return>", lambda e: threading.Thread(target=process_initial_input).start())
+        set_prompt("https://", process_initial_input)
+        ui_post(entry.config, state=tk.NORMAL)
+        ui_post(entry.focus_set)
     except Exception as e:
         log_crash(f"Setup initial screen error: {str(e)}")
-        try:
-            output.insert(tk.END, "Nextdomain v3.1211 - Matrix Style Scanner\n")
-            entry.delete(0, tk.END)
-            entry.insert(0, "https://")
-            entry.focus_set()
-            entry.bind("<Return>", lambda e: threading.Thread(target=process_initial_input).start())
-        except:
-            pass
-
-
-root = tk.Tk()
-root.title("nextdomain part 2")
-root.geometry("800x600")
-root.configure(bg="black")
+        render_text("Nextdomain v3.1211 - Matrix Style Scanner", output)
+        set_prompt("https://", process_initial_input)
+        ui_post(entry.focus_set)
 
 
 def handle_exception(exc_type, exc_value, exc_traceback):
@@ -792,34 +4032,118 @@ def handle_exception(exc_type, exc_value, exc_traceback):
     error_msg = ''.join(traceback.format_exception(exc_type, exc_value, exc_traceback))
     log_crash(f"Uncaught exception: {error_msg}")
     try:
-        if output and output.winfo_exists():
-            output.insert(tk.END, f"\n[System] Error handled. Continuing safely...\n")
+        ui_post(output.insert, tk.END, f"\n[System] Error handled. Continuing safely...\n")
     except:
         pass
 
 
-sys.excepthook = handle_exception
+# GUI widgets, created by build_gui so the module can be imported without a display
+root = None
+output = None
+entry = None
+style = None
+progress_bar = None
 
 
-output = tk.Text(root, bg="black", fg="green", font=("Courier", 12), wrap=tk.WORD)
-output.pack(expand=True, fill=tk.BOTH, padx=5, pady=5)
+def build_gui():
+    global root, output, entry, style, progress_bar
+    root = tk.Tk()
+    root.title("nextdomain part 2")
+    root.geometry("800x600")
+    root.configure(bg="black")
+
+    sys.excepthook = handle_exception
+
+    output = tk.Text(root, bg="black", fg="green", font=("Courier", 12), wrap=tk.WORD)
+    output.pack(expand=True, fill=tk.BOTH, padx=5, pady=5)
+
+    entry = tk.Entry(root, bg="black", fg="green", font=("Courier", 12), insertbackground="green")
+    entry.pack(fill=tk.X, padx=5, pady=5)
 
+    style = ttk.Style()
+    style.theme_use('clam')
+    style.configure("TButton", foreground="white", background="#0f5132", font=("Courier", 10, "bold"), padding=5)
+    style.map("TButton", background=[('active', '#14532d'), ('!active', '#0f5132')])
 
-entry = tk.Entry(root, bg="black", fg="green", font=("Courier", 12), insertbackground="green")
-entry.pack(fill=tk.X, padx=5, pady=5)
+    progress_bar = ttk.Progressbar(root, mode="indeterminate")
+    progress_bar.pack(fill=tk.X, padx=5, pady=5)
 
+    setup_initial_screen()
+    root.after(0, drain_ui_queue)
 
-style = ttk.Style()
-style.theme_use('clam')
-style.configure("TButton", foreground="white", background="#0f5132", font=("Courier", 10, "bold"), padding=5)
-style.map("TButton", background=[('active', '#14532d'), ('!active', '#0f5132')])
 
+def run_batch(args):
+    """Scan domains from the command line or a file and stream JSON Lines to stdout"""
+    sources = []
+    if args.batch:
+        sources.append(sys.stdin if args.batch == "-" else open(args.batch, "r", encoding="utf-8"))
+    sources.append(args.urls)
+    urls = (url for source in sources for url in map(normalize_domain, source) if url)
+    count = 0
+    exporter = None
+    try:
+        if args.processes > 1:
+            results = scan_domains_sharded(urls, args.processes, args.workers, args.depth, args.deadline,
+                                           export_path=args.export)
+        else:
+            exporter = ScanExporter(args.export) if args.export else None
+            results = scan_domains(urls, workers=args.workers, max_depth=args.depth, deadline=args.deadline,
+                                   on_row=exporter.write if exporter else None)
+        for result in results:
+            sys.stdout.write(json.dumps(result) + "\n")
+            sys.stdout.flush()
+            count += 1
+    except BrokenPipeError:
+        return 0
+    finally:
+        if exporter is not None:
+            exporter.close()
+        for source in sources:
+            if source not in (sys.stdin, args.urls):
+                source.close()
+    sys.stderr.write(f"Scanned {count} domains\n")
+    if exporter is not None:
+        sys.stderr.write(f"Exported {exporter.rows} rows to {args.export}\n")
+    if args.metrics:
+        export_metrics(args.metrics)
+    return 0
 
-progress_bar = ttk.Progressbar(root, mode="indeterminate")
-progress_bar.pack(fill=tk.X, padx=5, pady=5)
 
+def main(argv=None):
+    global http_timeout, crawl_incremental
+    parser = argparse.ArgumentParser(prog="nextdomain",
+                                     description="Nextdomain scanner. Starts the GUI when no domains are given.")
+    parser.add_argument("urls", nargs="*", help="domains or URLs to scan headlessly")
+    parser.add_argument("--batch", metavar="FILE", help="file with one domain per line ('-' for stdin)")
+    parser.add_argument("--workers", type=int, default=batch_workers, help="domains scanned concurrently")
+    parser.add_argument("--depth", type=int, default=batch_crawl_depth, help="crawl depth per domain")
+    parser.add_argument("--timeout", type=float, default=http_timeout, help="per-request timeout in seconds")
+    parser.add_argument("--processes", type=int, default=batch_processes,
+                        help="shard domains across this many processes (default: threads only)")
+    parser.add_argument("--deadline", type=float, default=batch_domain_deadline,
+                        help="seconds before a single domain's scan is abandoned (0 for none)")
+    parser.add_argument("--metrics", metavar="FILE", help="write a metrics snapshot here after a batch run")
+    parser.add_argument("--export", metavar="FILE",
+                        help="stream every crawled page to FILE (.jsonl or .csv) instead of listing pages on stdout")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"reuse and store each domain's crawl state in {history_db_path} for rescans")
+    args = parser.parse_args(argv)
+    http_timeout = args.timeout
 
-setup_initial_screen()
+    if args.urls or args.batch:
+        # Headless runs leave the history database alone unless asked to
+        crawl_incremental = args.incremental
+        return run_batch(args)
+    if tk is None:
+        parser.error("tkinter is not available; pass domains or --batch to run headless")
+    try:
+        build_gui()
+    except tk.TclError as e:
+        parser.error(f"cannot start the GUI ({e}); pass domains or --batch to run headless")
+    root.mainloop()
+    return 0
 
 
-root.mainloop()
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())